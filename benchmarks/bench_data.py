@@ -0,0 +1,206 @@
+"""Mede os caminhos de dados e de relatórios de gestor_despesas.py sobre despesas sintéticas.
+
+- Geração de uma base sintética com N despesas (10k, 1M, 10M...), reaproveitada entre execuções com --data-dir.
+- DatabaseManager.get_data_as_dataframe para todas as combinações de filtros (sem cache).
+- Débito de add_expense / delete_expense (uma transação por operação) e de add_expenses / delete_expenses.
+- Preenchimento da tabela sem interface, página a página como populate_table (fetch_table_page):
+  primeira página e percurso das primeiras --pages páginas com o cursor.
+- Pipeline de exportação para PDF: agregados da vista + build_pdf_report (gráficos ReportLab por omissão).
+
+Com --save guarda os resultados em JSON; com --baseline compara com uma execução anterior e
+falha (código 1) se algum caso ficar mais lento do que a tolerância. --profile mostra no fim a
+instrumentação do módulo (tempos por consulta, acertos da cache, gráficos).
+
+Uso:
+    python benchmarks/bench_data.py [--rows 10000 1000000] [--repeat 3] [--data-dir bench_data]
+                                    [--save resultados.json] [--baseline anterior.json --tolerance 0.25]
+"""
+import argparse
+import itertools
+import json
+import os
+import random
+import statistics
+import sqlite3
+import sys
+import tempfile
+import time
+from contextlib import closing
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import gestor_despesas as g  # noqa: E402
+
+YEARS = range(2015, 2025)
+# Valores usados em cada filtro; as combinações cobrem os 16 subconjuntos de (moeda, ano, mês, categoria).
+FILTER_VALUES = {"currency": "EUR", "year": 2024, "month": 6, "category": "Alimentação"}
+
+
+def synthetic_expenses(rows, seed=42):
+    """Gera `rows` despesas (year, month, category, amount, currency) com distribuição uniforme."""
+    rng = random.Random(seed)
+    currencies = list(g.CURRENCY_MAP)
+    for _ in range(rows):
+        yield (rng.choice(YEARS), rng.randint(1, 12), rng.choice(g.CATEGORIES),
+               rng.randint(100, 50000) / 100, rng.choice(currencies))
+
+
+def ledger(data_dir, rows):
+    """Devolve o caminho de uma base com `rows` despesas, criando-a só se ainda não existir."""
+    path = os.path.join(data_dir, f"ledger_{rows}.db")
+    if not os.path.exists(path):
+        started = time.perf_counter()
+        with g.DatabaseManager(path + ".tmp", cache_size=0) as db:
+            for chunk in g._chunked(synthetic_expenses(rows), 100_000):
+                db.add_expenses(chunk)
+        os.replace(path + ".tmp", path)
+        print(f"  base sintética com {rows} linhas criada em {time.perf_counter() - started:.1f} s", file=sys.stderr)
+    return path
+
+
+def timed(fn, repeat):
+    """Executa fn() uma vez sem medir (imports tardios, cache de páginas do SQLite) e depois
+    `repeat` vezes; devolve a mediana em segundos."""
+    fn()
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - started)
+    return statistics.median(samples)
+
+
+def filter_combinations():
+    for size in range(len(FILTER_VALUES) + 1):
+        for columns in itertools.combinations(FILTER_VALUES, size):
+            yield "+".join(columns) or "sem_filtros", {column: FILTER_VALUES[column] for column in columns}
+
+
+def bench_queries(db, repeat):
+    for name, filters in filter_combinations():
+        yield f"get_data_as_dataframe[{name}]", timed(lambda: db.get_data_as_dataframe(filters), repeat), None
+
+
+def bench_writes(db, path, writes):
+    """Insere e apaga `writes` despesas, uma a uma e em lote; a base fica como estava."""
+    expenses = list(synthetic_expenses(writes, seed=7))
+
+    def inserted_ids():
+        with closing(sqlite3.connect(path)) as conn:
+            return [row[0] for row in conn.execute("SELECT id FROM expenses ORDER BY id DESC LIMIT ?", (writes,))]
+
+    started = time.perf_counter()
+    for expense in expenses:
+        db.add_expense(*expense)
+    elapsed = time.perf_counter() - started
+    yield "add_expense", elapsed, writes / elapsed
+
+    ids = inserted_ids()
+    started = time.perf_counter()
+    for expense_id in ids:
+        db.delete_expense(expense_id)
+    elapsed = time.perf_counter() - started
+    yield "delete_expense", elapsed, writes / elapsed
+
+    started = time.perf_counter()
+    db.add_expenses(expenses)
+    elapsed = time.perf_counter() - started
+    yield "add_expenses (lote)", elapsed, writes / elapsed
+
+    ids = inserted_ids()
+    started = time.perf_counter()
+    db.delete_expenses(ids)
+    elapsed = time.perf_counter() - started
+    yield "delete_expenses (lote)", elapsed, writes / elapsed
+
+
+def bench_table(db, repeat, pages):
+    page_size = g.ExpenseTrackerApp.PAGE_SIZE
+
+    def scroll():
+        cursor = None
+        for _ in range(pages):
+            rows, cursor = g.fetch_table_page(db, {}, cursor, page_size)
+            if len(rows) < page_size:
+                break
+
+    yield "populate_table[primeira página]", timed(lambda: g.fetch_table_page(db, {}, None, page_size), repeat), None
+    yield f"populate_table[{pages} páginas]", timed(scroll, repeat), None
+
+
+def bench_pdf(db, repeat, backend, out_dir):
+    filters = {"currency": FILTER_VALUES["currency"]}
+    renderer = g.ChartRenderer(backend)
+    filepath = os.path.join(out_dir, "bench.pdf")
+
+    def export():
+        summary = db.get_summary(filters)
+        g.build_pdf_report(filepath, summary, db.get_category_totals(filters), db.get_monthly_totals(filters), renderer=renderer)
+
+    try:
+        yield f"export_to_pdf[{backend}]", timed(export, repeat), None
+    finally:
+        renderer.close()
+
+
+def run(rows, args, data_dir):
+    path = ledger(data_dir, rows)
+    results = []
+    with g.DatabaseManager(path, cache_size=0) as db:
+        for name, seconds, rate in itertools.chain(bench_queries(db, args.repeat), bench_writes(db, path, args.writes),
+                                                   bench_table(db, args.repeat, args.pages), bench_pdf(db, args.repeat, args.charts, data_dir)):
+            results.append({"rows": rows, "case": name, "ms": seconds * 1000, "rate": rate})
+            extra = f"  ({rate:,.0f}/s)" if rate and name.startswith(("add_", "delete_")) else ""
+            print(f"{rows:>10}  {name:<52}{seconds * 1000:>12.2f} ms{extra}")
+    return results
+
+
+def compare(results, baseline_path, tolerance):
+    """Devolve a lista de casos mais lentos do que a referência além da tolerância."""
+    with open(baseline_path, encoding="utf-8") as fh:
+        baseline = {(r["rows"], r["case"]): r["ms"] for r in json.load(fh)["results"]}
+    regressions = []
+    for result in results:
+        reference = baseline.get((result["rows"], result["case"]))
+        if reference and result["ms"] > reference * (1 + tolerance):
+            regressions.append(f"{result['rows']} linhas, {result['case']}: {result['ms']:.2f} ms (referência {reference:.2f} ms)")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, nargs="+", default=[10_000], help="Tamanhos das bases sintéticas (padrão: 10000)")
+    parser.add_argument("--repeat", type=int, default=3, help="Repetições de cada caso (usa-se a mediana)")
+    parser.add_argument("--writes", type=int, default=1000, help="Despesas inseridas/apagadas nos testes de escrita")
+    parser.add_argument("--pages", type=int, default=50, help="Páginas da tabela percorridas no teste de paginação")
+    parser.add_argument("--charts", default="reportlab", choices=g.ChartRenderer.BACKENDS, help="Motor dos gráficos do PDF")
+    parser.add_argument("--data-dir", help="Pasta onde guardar e reaproveitar as bases sintéticas (padrão: temporária)")
+    parser.add_argument("--save", help="Guarda os resultados neste ficheiro JSON")
+    parser.add_argument("--baseline", help="Resultados JSON de referência para detetar regressões")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Abrandamento tolerado face à referência (padrão: 0.25)")
+    parser.add_argument("--profile", action="store_true", help="Mostra no fim a instrumentação do módulo")
+    args = parser.parse_args(argv)
+
+    g.stats.enabled = args.profile
+    with tempfile.TemporaryDirectory() as tmp:
+        data_dir = args.data_dir or tmp
+        os.makedirs(data_dir, exist_ok=True)
+        results = [result for rows in args.rows for result in run(rows, args, data_dir)]
+
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as fh:
+            json.dump({"python": sys.version.split()[0], "sqlite": sqlite3.sqlite_version, "results": results}, fh,
+                      ensure_ascii=False, indent=2)
+    if args.profile:
+        print()
+        g.stats.dump(sys.stdout)
+
+    regressions = compare(results, args.baseline, args.tolerance) if args.baseline else []
+    for regression in regressions:
+        print(f"REGRESSÃO: {regression}", file=sys.stderr)
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,109 @@
+"""Mede o arranque de gestor_despesas.py e falha se houver regressões.
+
+- Tempo de importação do módulo (python -X importtime), num processo novo.
+- Módulos pesados (pandas, plotly, reportlab...) carregados só pelo import: devem ser zero.
+- Tempo até à primeira pintura da janela (requer ambiente gráfico; ignorado sem DISPLAY).
+
+Uso:
+    python benchmarks/bench_startup.py [--max-import-ms 400] [--max-first-paint-ms 1500] [--runs 5]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+IMPORT_PROBE = """
+import json, sys
+import gestor_despesas as g
+print(json.dumps([m for m in g.HEAVY_MODULES if m in sys.modules]))
+"""
+
+FIRST_PAINT_PROBE = """
+import json, sys, time
+started = time.perf_counter()
+import gestor_despesas as g
+app = g.ExpenseTrackerApp(db_name=sys.argv[1])
+app.update()
+elapsed = time.perf_counter() - started
+heavy = [m for m in g.HEAVY_MODULES if m in sys.modules]
+app.on_close()
+print(json.dumps({"first_paint_ms": elapsed * 1000, "heavy_loaded": heavy}))
+"""
+
+
+def _run(code, *args, importtime=False):
+    cmd = [sys.executable] + (["-X", "importtime"] if importtime else []) + ["-c", code, *args]
+    return subprocess.run(cmd, cwd=ROOT, capture_output=True, text=True)
+
+
+def measure_import():
+    """Devolve (ms cumulativos de gestor_despesas, módulos pesados carregados, 10 módulos mais lentos)."""
+    result = _run(IMPORT_PROBE, importtime=True)
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr)
+    timings = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        timings.append((name.strip(), int(self_us), int(cumulative_us)))
+    total_us = next(cumulative for name, _, cumulative in timings if name == "gestor_despesas")
+    slowest = sorted(timings, key=lambda t: t[1], reverse=True)[:10]
+    return total_us / 1000, json.loads(result.stdout), slowest
+
+
+def measure_first_paint():
+    """Devolve o resultado do arranque da janela, ou None se não houver ambiente gráfico."""
+    with tempfile.TemporaryDirectory() as tmp:
+        result = _run(FIRST_PAINT_PROBE, os.path.join(tmp, "bench.db"))
+    if result.returncode != 0:
+        if "TclError" in result.stderr:
+            return None
+        raise RuntimeError(result.stderr)
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5, help="Repetições (usa-se a mediana)")
+    parser.add_argument("--max-import-ms", type=float, default=400.0)
+    parser.add_argument("--max-first-paint-ms", type=float, default=1500.0)
+    args = parser.parse_args(argv)
+
+    failures = []
+
+    import_times, heavy, slowest = [], [], []
+    for _ in range(args.runs):
+        elapsed, heavy, slowest = measure_import()
+        import_times.append(elapsed)
+    import_ms = statistics.median(import_times)
+    print(f"import gestor_despesas: {import_ms:.1f} ms (mediana de {args.runs})")
+    print("  módulos mais lentos (self):")
+    for name, self_us, _ in slowest:
+        print(f"    {self_us / 1000:8.1f} ms  {name}")
+    if heavy:
+        failures.append(f"módulos pesados carregados no import: {', '.join(heavy)}")
+    if import_ms > args.max_import_ms:
+        failures.append(f"import demorou {import_ms:.1f} ms (> {args.max_import_ms} ms)")
+
+    paints = [measure_first_paint() for _ in range(args.runs)]
+    if paints[0] is None:
+        print("primeira pintura: ignorada (sem ambiente gráfico)")
+    else:
+        paint_ms = statistics.median(p["first_paint_ms"] for p in paints)
+        print(f"primeira pintura: {paint_ms:.1f} ms (mediana de {args.runs})")
+        if paint_ms > args.max_first_paint_ms:
+            failures.append(f"primeira pintura demorou {paint_ms:.1f} ms (> {args.max_first_paint_ms} ms)")
+
+    for failure in failures:
+        print(f"REGRESSÃO: {failure}", file=sys.stderr)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
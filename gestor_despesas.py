@@ -1,119 +1,1549 @@
 import sqlite3
 import customtkinter as ctk
 from tkinter import ttk, messagebox, filedialog
-import pandas as pd
-import plotly.express as px
-from reportlab.pdfgen import canvas
-from reportlab.lib.pagesizes import letter
-from reportlab.lib.units import inch
 from datetime import datetime
+from decimal import ROUND_HALF_UP, Decimal
+from io import BytesIO, TextIOWrapper
+from collections import Counter, OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from multiprocessing.util import Finalize
+from contextlib import contextmanager, nullcontext
+from pathlib import Path
+import argparse
+import csv
+import atexit
+import asyncio
+import importlib
+import itertools
+import json
+import logging
 import os
+import queue
+import re
+import sys
+import threading
+import time
+
+# pandas, numpy, plotly e reportlab são importados dentro das funções que os usam:
+# só carregam quando são precisos (ou no pré-carregamento em segundo plano da interface),
+# para a janela aparecer sem esperar por eles.
+HEAVY_MODULES = ("pandas", "numpy", "plotly.express", "reportlab.pdfgen.canvas", "reportlab.graphics.charts.barcharts",
+                 "reportlab.graphics.charts.linecharts", "reportlab.graphics.charts.piecharts", "reportlab.graphics.renderPDF")
+
+# --- CONSTANTES PARTILHADAS ---
+
+CURRENCY_MAP = {"BRL": "R$", "USD": "$", "EUR": "€"}
+MONTH_MAP = {"Janeiro": 1, "Fevereiro": 2, "Março": 3, "Abril": 4, "Maio": 5, "Junho": 6, "Julho": 7, "Agosto": 8, "Setembro": 9, "Outubro": 10, "Novembro": 11, "Dezembro": 12}
+MONTH_MAP_INV = {v: k for k, v in MONTH_MAP.items()}
+CATEGORIES = ["Alimentação", "Moradia", "Transporte", "Serviços", "Lazer", "Outros"]
+# Os valores são guardados em cêntimos (unidades menores); todas as moedas suportadas têm 2 casas decimais.
+MINOR_UNITS = 100
+# Moeda base da tabela fx_rates: cada taxa indica quanto vale 1 unidade da moeda em EUR.
+FX_BASE_CURRENCY = "EUR"
+
+# --- FUNÇÕES AUXILIARES ---
+
+def _chunked(iterable, size):
+    """Divide um iterável em listas de no máximo `size` elementos, sem o materializar por inteiro."""
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+# Valores dos menus de filtro que significam "sem filtro".
+FILTER_ALL_VALUES = {
+    "year": "Todos os Anos",
+    "month": "Todos os Meses",
+    "category": "Todas as Categorias",
+    "currency": "Todas as Moedas",
+}
+
+
+def normalize_filters(filters):
+    """Reduz o dicionário de filtros a um tuplo ordenado (coluna, valor), sem os valores "Todos".
+
+    Ano e mês são convertidos para inteiros, pelo que {"year": "2024"} e {"year": 2024}
+    produzem a mesma consulta e a mesma chave de cache.
+    """
+    normalized = []
+    if filters:
+        for column, all_value in FILTER_ALL_VALUES.items():
+            value = filters.get(column)
+            if value in (None, all_value):
+                continue
+            if column in ("year", "month"):
+                value = int(value)
+            normalized.append((column, value))
+    return tuple(normalized)
+
+
+def to_cents(amount):
+    """Converte um valor em unidades (float, str ou Decimal) para cêntimos inteiros, arredondando meio para cima."""
+    return int((Decimal(str(amount)) * MINOR_UNITS).quantize(Decimal(1), rounding=ROUND_HALF_UP))
+
+
+class FxRateMissing(ValueError):
+    """Não há taxa de câmbio para converter uma das moedas pedidas."""
+
+
+class StatementError(ValueError):
+    """O ficheiro de extrato não pode ser lido (vazio, ou num formato que o leitor de CSV não reconhece)."""
+
+
+def _import_modules(names, task=None):
+    """Importa os módulos indicados (usado para pré-carregar HEAVY_MODULES em segundo plano)."""
+    for name in names:
+        if task: task.check()
+        importlib.import_module(name)
+
+
+def format_table_rows(df):
+    """Formata um DataFrame de despesas para a tabela (ID, Ano, Mês, Categoria, Valor), coluna a coluna."""
+    import numpy as np
+    months = df['month'].map(MONTH_MAP_INV).fillna("N/A")
+    symbols = df['currency'].map(CURRENCY_MAP).fillna("")
+    amounts = symbols + " " + np.char.mod("%.2f", df['amount'].to_numpy(dtype=float))
+    return list(zip(df['id'].tolist(), df['year'].tolist(), months.tolist(), df['category'].tolist(), amounts.tolist()))
+
+
+def fetch_table_page(db, filters, cursor, limit):
+    """Lê e formata a página da tabela a seguir a `cursor` (None para a primeira).
+
+    Devolve (linhas formatadas, cursor da página seguinte); com uma página vazia o cursor não muda.
+    """
+    df = db.get_page(filters, after=cursor, limit=limit)
+    if not df.empty:
+        last = df.iloc[-1]
+        cursor = (int(last['year']), int(last['month']), int(last['id']))
+    return format_table_rows(df), cursor
+
+
+def monthly_series(df):
+    """Agrupa (year, month, amount) numa série mensal contínua: DataFrame com period ('AAAA-MM') e amount."""
+    import pandas as pd
+    if df.empty:
+        return pd.DataFrame({"period": pd.Series(dtype=str), "amount": pd.Series(dtype=float)})
+    df = df.groupby(['year', 'month'], as_index=False)['amount'].sum()
+    periods = pd.PeriodIndex.from_fields(year=df['year'], month=df['month'], freq='M')
+    monthly = df['amount'].set_axis(periods)
+    monthly = monthly.reindex(pd.period_range(periods.min(), periods.max(), freq='M'), fill_value=0.0)
+    return pd.DataFrame({"period": monthly.index.strftime('%Y-%m'), "amount": monthly.to_numpy()})
+
+
+def write_csv_export(df, filepath):
+    """Escreve despesas no formato CSV da aplicação (';', vírgula decimal, meses por extenso)."""
+    df = df.assign(month=df['month'].map(MONTH_MAP_INV))
+    df.to_csv(filepath, index=False, decimal=',', sep=';')
+    return filepath
+
+# --- INSTRUMENTAÇÃO (OPCIONAL) ---
+
+class Instrumentation:
+    """Contadores e tempos acumulados das consultas, da cache e dos gráficos.
+
+    Desligada por omissão: ative-a com GESTOR_DESPESAS_PROFILE=1 ou com --profile na linha de
+    comandos. Cada span é também registado em DEBUG no logger "gestor_despesas".
+    """
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self.counters = Counter()
+        self.timings = {}
+
+    def incr(self, name, n=1):
+        if self.enabled:
+            with self._lock:
+                self.counters[name] += n
+
+    def span(self, name):
+        """Contexto que mede a duração do bloco sob `name` (sem custo quando desligada)."""
+        return self._span(name) if self.enabled else nullcontext()
+
+    @contextmanager
+    def _span(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - started)
+
+    def record(self, name, seconds):
+        with self._lock:
+            count, total, worst = self.timings.get(name, (0, 0.0, 0.0))
+            self.timings[name] = (count + 1, total + seconds, max(worst, seconds))
+        logger.debug("%s: %.2f ms", name, seconds * 1000)
+
+    def reset(self):
+        with self._lock:
+            self.counters.clear()
+            self.timings.clear()
+
+    def snapshot(self):
+        """Devolve {"counters": {...}, "timings": {nome: {count, total_ms, mean_ms, max_ms}}}."""
+        with self._lock:
+            timings = {name: {"count": count, "total_ms": total * 1000, "mean_ms": total * 1000 / count, "max_ms": worst * 1000}
+                       for name, (count, total, worst) in self.timings.items()}
+            return {"counters": dict(self.counters), "timings": timings}
+
+    def dump(self, file=None):
+        """Escreve uma tabela com os tempos (ordenados pelo total) e os contadores."""
+        file = file or sys.stderr
+        data = self.snapshot()
+        print(f"{'span':<36}{'n':>8}{'total ms':>12}{'média ms':>12}{'máx ms':>12}", file=file)
+        for name, t in sorted(data["timings"].items(), key=lambda item: item[1]["total_ms"], reverse=True):
+            print(f"{name:<36}{t['count']:>8}{t['total_ms']:>12.1f}{t['mean_ms']:>12.2f}{t['max_ms']:>12.2f}", file=file)
+        if data["counters"]:
+            print(f"\n{'contador':<36}{'valor':>8}", file=file)
+        for name, value in sorted(data["counters"].items()):
+            print(f"{name:<36}{value:>8}", file=file)
+
+
+logger = logging.getLogger("gestor_despesas")
+stats = Instrumentation(enabled=os.environ.get("GESTOR_DESPESAS_PROFILE", "") not in ("", "0"))
 
 # --- CLASSE DE GESTÃO DA BASE DE DADOS ---
 
 class DatabaseManager:
-    def __init__(self, db_name="expenses.db"):
+    # Pragmas aplicados uma única vez ao abrir a conexão persistente.
+    PRAGMAS = {
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "cache_size": -64000,      # ~64 MB de cache de páginas
+        "mmap_size": 268435456,    # 256 MB mapeados em memória
+        "temp_store": "MEMORY",
+        "foreign_keys": "ON",
+    }
+    STATEMENT_CACHE_SIZE = 256
+    # Abaixo do limite de variáveis por instrução do SQLite (999 nas versões antigas).
+    BATCH_SIZE = 500
+    # Número máximo de agregados mantidos em cache (LRU). Linhas e páginas da tabela não são
+    # guardadas: o seu tamanho cresce com o número de despesas e expulsariam os agregados.
+    CACHE_SIZE = 64
+
+    def __init__(self, db_name="expenses.db", cache_size=CACHE_SIZE):
         self.db_name = db_name
+        self.cache_size = cache_size
         self._conn = None
+        self._lock = threading.RLock()
+        self._local = threading.local()
+        self._readers = []
+        self._closed = False
+        self._cache = OrderedDict()
+        self._cache_version = None
+        self._data_version = 0
         self.setup()
 
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
     def _get_connection(self):
-        """Retorna uma conexão com a base de dados."""
-        return sqlite3.connect(self.db_name)
+        """Retorna a conexão persistente, abrindo-a e configurando-a na primeira utilização."""
+        self._check_open()
+        if self._conn is None:
+            conn = sqlite3.connect(self.db_name, check_same_thread=False,
+                                   cached_statements=self.STATEMENT_CACHE_SIZE)
+            for pragma, value in self.PRAGMAS.items():
+                conn.execute(f"PRAGMA {pragma} = {value}")
+            self._conn = conn
+        return self._conn
 
-    def _migrate_database(self):
-        """Verifica e adiciona novas colunas à tabela se necessário."""
-        conn = self._get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute("PRAGMA table_info(expenses)")
-        columns = [col[1] for col in cursor.fetchall()]
-        
+    def _open_reader(self):
+        """Abre uma conexão só de leitura ao mesmo ficheiro (modo WAL: não bloqueia nem é bloqueada pelas escritas)."""
+        conn = sqlite3.connect(Path(self.db_name).resolve().as_uri() + "?mode=ro", uri=True, check_same_thread=False,
+                               cached_statements=self.STATEMENT_CACHE_SIZE)
+        for pragma in ("cache_size", "mmap_size", "temp_store"):
+            conn.execute(f"PRAGMA {pragma} = {self.PRAGMAS[pragma]}")
+        return conn
+
+    @contextmanager
+    def _reading(self):
+        """Conexão para leituras: uma conexão só de leitura por thread, aberta a pedido.
+
+        As consultas não usam a conexão partilhada nem o seu lock, pelo que uma leitura longa
+        em segundo plano (exportação, tabela completa) não atrasa as escritas feitas pela interface.
+        Uma base ":memory:" não admite segunda conexão e lê pela conexão partilhada.
+        """
+        if self.db_name == ":memory:":
+            with self._lock:
+                yield self._get_connection()
+            return
+        self._check_open()
+        conn = getattr(self._local, "reader", None)
+        if conn is None:
+            conn = self._local.reader = self._open_reader()
+            with self._lock:
+                self._readers.append(conn)
+        yield conn
+
+    @contextmanager
+    def _transaction(self):
+        """Executa um bloco numa única transação, com commit ou rollback automático."""
+        with self._lock, stats.span("sql.transaction"):
+            conn = self._get_connection()
+            try:
+                with conn:
+                    yield conn
+            finally:
+                self._data_version += 1
+
+    def _check_open(self):
+        if self._closed:
+            raise sqlite3.ProgrammingError(f"A base de dados {self.db_name} já foi fechada.")
+
+    def close(self):
+        """Fecha todas as conexões. É definitivo: operações posteriores lançam sqlite3.ProgrammingError,
+        em vez de reabrirem silenciosamente uma conexão que ninguém voltaria a fechar."""
+        with self._lock:
+            self._closed = True
+            for reader in self._readers:
+                reader.close()
+            self._readers.clear()
+            self._local = threading.local()
+            if self._conn is not None:
+                try:
+                    self._conn.execute("PRAGMA optimize")
+                finally:
+                    self._conn.close()
+                    self._conn = None
+                    self._cache.clear()
+                    self._cache_version = None
+
+    # --- Migrações versionadas (PRAGMA user_version) ---
+    # Cada função leva o esquema da versão N para N+1; só as pendentes são executadas no arranque.
+
+    @staticmethod
+    def _migration_add_currency(conn):
+        """v1: adiciona a coluna 'currency' (bases de dados anteriores à versão multimoeda)."""
+        columns = [col[1] for col in conn.execute("PRAGMA table_info(expenses)").fetchall()]
         if 'currency' not in columns:
-            cursor.execute("ALTER TABLE expenses ADD COLUMN currency TEXT NOT NULL DEFAULT 'EUR'")
-            conn.commit()
+            conn.execute("ALTER TABLE expenses ADD COLUMN currency TEXT NOT NULL DEFAULT 'EUR'")
             print("Coluna 'currency' adicionada à base de dados.")
-            
-        conn.close()
 
-    def setup(self):
-        """Cria a tabela 'expenses' e executa migrações."""
-        conn = self._get_connection()
-        cursor = conn.cursor()
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS expenses (
+    @staticmethod
+    def _migration_filter_indexes(conn):
+        """v2: índices compostos para os filtros de get_data_as_dataframe.
+
+        Cada índice termina em (year, month) e o SQLite acrescenta o rowid (id) implicitamente,
+        pelo que, após as igualdades nas colunas iniciais, o ORDER BY year DESC, month DESC, id DESC
+        é satisfeito percorrendo o índice ao contrário, sem ordenação temporária.
+        """
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_expenses_period ON expenses (year, month)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_expenses_currency_period ON expenses (currency, year, month)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_expenses_category_period ON expenses (category, year, month)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_expenses_currency_category_period ON expenses (currency, category, year, month)")
+
+    @staticmethod
+    def _migration_integer_cents(conn):
+        """v3: guarda os valores como cêntimos inteiros (amount_cents) em vez de REAL.
+
+        O SQLite não altera o tipo de uma coluna, por isso a tabela é reconstruída
+        (mantendo ids, a sequência AUTOINCREMENT e os índices).
+        """
+        row = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'expenses'").fetchone()
+        conn.execute('''
+            CREATE TABLE expenses_new (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
                 year INTEGER NOT NULL,
                 month INTEGER NOT NULL,
                 category TEXT NOT NULL,
-                amount REAL NOT NULL
+                amount_cents INTEGER NOT NULL,
+                currency TEXT NOT NULL DEFAULT 'EUR'
             )
         ''')
-        conn.commit()
-        conn.close()
+        conn.execute(f"INSERT INTO expenses_new (id, year, month, category, amount_cents, currency) "
+                     f"SELECT id, year, month, category, CAST(ROUND(amount * {MINOR_UNITS}) AS INTEGER), currency FROM expenses")
+        conn.execute("DROP TABLE expenses")
+        conn.execute("ALTER TABLE expenses_new RENAME TO expenses")
+        if row is not None:
+            conn.execute("UPDATE sqlite_sequence SET seq = MAX(seq, ?) WHERE name = 'expenses'", (row[0],))
+        DatabaseManager._migration_filter_indexes(conn)
+
+    @staticmethod
+    def _migration_fx_rates(conn):
+        """v4: tabela local de taxas de câmbio (carregada de ficheiro, sem rede)."""
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS fx_rates (
+                rate_date TEXT NOT NULL,
+                currency TEXT NOT NULL,
+                rate REAL NOT NULL,
+                PRIMARY KEY (currency, rate_date)
+            )
+        ''')
+
+    # Agregação que alimenta o rollup: usada no preenchimento inicial, em rebuild_rollup e em verify_rollup.
+    ROLLUP_SOURCE_QUERY = ("SELECT year, month, category, currency, SUM(amount_cents), COUNT(*) FROM expenses "
+                           "GROUP BY year, month, category, currency")
+
+    @staticmethod
+    def _migration_monthly_rollup(conn):
+        """v5: tabela monthly_totals mantida por triggers em cada INSERT/UPDATE/DELETE de expenses.
+
+        Como os triggers correm no SQLite, todas as escritas (add_expense, add_expenses,
+        delete_expenses, importações e até outras ferramentas) mantêm o rollup atualizado.
+        """
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS monthly_totals (
+                year INTEGER NOT NULL,
+                month INTEGER NOT NULL,
+                category TEXT NOT NULL,
+                currency TEXT NOT NULL,
+                total_cents INTEGER NOT NULL,
+                count INTEGER NOT NULL,
+                PRIMARY KEY (year, month, category, currency)
+            ) WITHOUT ROWID
+        ''')
+        add_row = '''
+                INSERT INTO monthly_totals (year, month, category, currency, total_cents, count)
+                VALUES (NEW.year, NEW.month, NEW.category, NEW.currency, NEW.amount_cents, 1)
+                ON CONFLICT (year, month, category, currency)
+                DO UPDATE SET total_cents = total_cents + excluded.total_cents, count = count + 1;'''
+        remove_row = '''
+                UPDATE monthly_totals SET total_cents = total_cents - OLD.amount_cents, count = count - 1
+                WHERE year = OLD.year AND month = OLD.month AND category = OLD.category AND currency = OLD.currency;
+                DELETE FROM monthly_totals
+                WHERE year = OLD.year AND month = OLD.month AND category = OLD.category AND currency = OLD.currency AND count <= 0;'''
+        conn.execute(f"CREATE TRIGGER IF NOT EXISTS trg_expenses_rollup_insert AFTER INSERT ON expenses BEGIN {add_row} END")
+        conn.execute(f"CREATE TRIGGER IF NOT EXISTS trg_expenses_rollup_delete AFTER DELETE ON expenses BEGIN {remove_row} END")
+        conn.execute("CREATE TRIGGER IF NOT EXISTS trg_expenses_rollup_update "
+                     f"AFTER UPDATE OF year, month, category, currency, amount_cents ON expenses BEGIN {remove_row} {add_row} END")
+        conn.execute("DELETE FROM monthly_totals")
+        conn.execute("INSERT INTO monthly_totals (year, month, category, currency, total_cents, count) "
+                     + DatabaseManager.ROLLUP_SOURCE_QUERY)
+
+    MIGRATIONS = (
+        _migration_add_currency,
+        _migration_filter_indexes,
+        _migration_integer_cents,
+        _migration_fx_rates,
+        _migration_monthly_rollup,
+    )
+
+    def _migrate_database(self):
+        """Aplica as migrações pendentes e regista a versão do esquema em PRAGMA user_version."""
+        with self._transaction() as conn:
+            version = conn.execute("PRAGMA user_version").fetchone()[0]
+            if version < len(self.MIGRATIONS) and not conn.in_transaction:
+                conn.execute("BEGIN")  # inclui as instruções DDL na mesma transação
+            for target, migration in enumerate(self.MIGRATIONS[version:], start=version + 1):
+                migration.__func__(conn)
+                conn.execute(f"PRAGMA user_version = {target}")
+
+    def setup(self):
+        """Cria a tabela 'expenses' e executa migrações."""
+        with self._transaction() as conn:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS expenses (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    year INTEGER NOT NULL,
+                    month INTEGER NOT NULL,
+                    category TEXT NOT NULL,
+                    amount REAL NOT NULL
+                )
+            ''')
         self._migrate_database()
 
     def add_expense(self, year, month, category, amount, currency):
         """Adiciona uma nova despesa com a sua moeda."""
-        conn = self._get_connection()
-        cursor = conn.cursor()
-        cursor.execute("INSERT INTO expenses (year, month, category, amount, currency) VALUES (?, ?, ?, ?, ?)",
-                       (year, month, category, amount, currency))
-        conn.commit()
-        conn.close()
+        with self._transaction() as conn:
+            conn.execute("INSERT INTO expenses (year, month, category, amount_cents, currency) VALUES (?, ?, ?, ?, ?)",
+                         (year, month, category, to_cents(amount), currency))
+
+    def add_expenses(self, expenses):
+        """Adiciona várias despesas (tuplos year, month, category, amount, currency) numa só transação."""
+        inserted = 0
+        rows = ((year, month, category, to_cents(amount), currency) for year, month, category, amount, currency in expenses)
+        with self._transaction() as conn:
+            for chunk in _chunked(rows, self.BATCH_SIZE):
+                conn.executemany("INSERT INTO expenses (year, month, category, amount_cents, currency) VALUES (?, ?, ?, ?, ?)",
+                                 chunk)
+                inserted += len(chunk)
+        return inserted
 
     def delete_expense(self, expense_id):
-        conn = self._get_connection()
-        cursor = conn.cursor()
-        cursor.execute("DELETE FROM expenses WHERE id = ?", (expense_id,))
-        conn.commit()
-        conn.close()
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM expenses WHERE id = ?", (expense_id,))
 
-    def get_data_as_dataframe(self, filters=None):
-        conn = self._get_connection()
-        query = "SELECT id, year, month, category, amount, currency FROM expenses"
-        conditions, params = [], []
-
-        if filters:
-            # --- Alterações aqui ---
-            if filters.get("year") not in (None, "Todos os Anos"):
-                conditions.append("year = ?"); params.append(filters["year"])
-            if filters.get("month") not in (None, "Todos os Meses"):
-                conditions.append("month = ?"); params.append(filters["month"])
-            if filters.get("category") not in (None, "Todas as Categorias"):
-                conditions.append("category = ?"); params.append(filters["category"])
-            if filters.get("currency") not in (None, "Todas as Moedas"):
-                conditions.append("currency = ?"); params.append(filters["currency"])
-            # --- Fim das alterações ---
-        
-        if conditions: query += " WHERE " + " AND ".join(conditions)
-        
+    def delete_expenses(self, expense_ids):
+        """Apaga várias despesas por id numa só transação, em blocos de BATCH_SIZE."""
+        deleted = 0
+        with self._transaction() as conn:
+            for chunk in _chunked(expense_ids, self.BATCH_SIZE):
+                placeholders = ", ".join("?" * len(chunk))
+                deleted += conn.execute(f"DELETE FROM expenses WHERE id IN ({placeholders})", chunk).rowcount
+        return deleted
+
+    def _build_where(self, filters):
+        """Converte o dicionário de filtros numa cláusula WHERE e respetivos parâmetros."""
+        normalized = normalize_filters(filters)
+        conditions = [f"{column} = ?" for column, _ in normalized]
+        params = [value for _, value in normalized]
+        where = " WHERE " + " AND ".join(conditions) if conditions else ""
+        return where, params
+
+    def _cached(self, kind, filters, compute, *args):
+        """Devolve o resultado de `compute(filters, *args)` a partir da cache LRU, calculando-o se necessário.
+
+        A cache é esvaziada sempre que os dados mudam: as escritas desta instância incrementam
+        _data_version e as de outras conexões (p. ex. uma importação pela linha de comandos)
+        alteram PRAGMA data_version. Os resultados em cache são partilhados e não devem ser alterados.
+        """
+        if not self.cache_size:
+            with stats.span(f"query.{kind}"):
+                return compute(filters, *args)
+        key = (kind, normalize_filters(filters)) + args
+        with self._lock:
+            version = self._cache_key_version()
+            if version != self._cache_version:
+                self._cache.clear()
+                self._cache_version = version
+            if key in self._cache:
+                stats.incr(f"cache.hit.{kind}")
+                self._cache.move_to_end(key)
+                return self._cache[key]
+        # O cálculo corre fora do lock; o resultado só é guardado se nada tiver sido escrito entretanto.
+        stats.incr(f"cache.miss.{kind}")
+        with stats.span(f"query.{kind}"):
+            result = compute(filters, *args)
+        with self._lock:
+            if self._cache_key_version() == version == self._cache_version:
+                self._cache[key] = result
+                if len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+        return result
+
+    def _cache_key_version(self):
+        return self._data_version, self._get_connection().execute("PRAGMA data_version").fetchone()[0]
+
+    def _select_query(self, filters):
+        where, params = self._build_where(filters)
+        query = f"SELECT id, year, month, category, amount_cents / {MINOR_UNITS}.0 AS amount, currency FROM expenses" + where
         query += " ORDER BY year DESC, month DESC, id DESC"
-        
-        df = pd.read_sql_query(query, conn, params=tuple(params))
-        conn.close()
+        return query, params
+
+    def _read_frame(self, query, params):
+        import pandas as pd
+        with self._reading() as conn, stats.span("sql.read_frame"):
+            df = pd.read_sql_query(query, conn, params=tuple(params))
+        stats.incr("sql.rows_read", len(df))
+        return df
+
+    def get_data_as_dataframe(self, filters=None):
+        with stats.span("query.rows"):
+            return self._read_frame(*self._select_query(filters))
+
+    def get_page(self, filters=None, after=None, limit=200):
+        """Devolve até `limit` linhas na ordem da tabela, a seguir à chave (year, month, id) `after`.
+
+        Paginação por chave (keyset): cada página é uma pesquisa no índice, com custo
+        independente da posição na tabela, ao contrário de OFFSET.
+        """
+        with stats.span("query.page"):
+            return self._query_page(filters, after, limit)
+
+    def _query_page(self, filters, after, limit):
+        where, params = self._build_where(filters)
+        if after is not None:
+            where += (" AND " if where else " WHERE ") + "(year, month, id) < (?, ?, ?)"
+            params.extend(after)
+        query = (f"SELECT id, year, month, category, amount_cents / {MINOR_UNITS}.0 AS amount, currency FROM expenses" + where
+                 + " ORDER BY year DESC, month DESC, id DESC LIMIT ?")
+        params.append(limit)
+        return self._read_frame(query, params)
+
+    def iter_row_batches(self, filters=None, batch_size=65536):
+        """Percorre as despesas filtradas em listas de até `batch_size` tuplos
+        (id, year, month, category, amount_cents, currency), na ordem da tabela.
+
+        Usa uma conexão só de leitura dedicada (ver _reading): com WAL, lê um instantâneo
+        consistente durante toda a exportação sem bloquear escritas.
+        """
+        where, params = self._build_where(filters)
+        query = ("SELECT id, year, month, category, amount_cents, currency FROM expenses" + where
+                 + " ORDER BY year DESC, month DESC, id DESC")
+        conn = self._open_reader()
+        try:
+            cursor = conn.execute(query, params)
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                yield rows
+        finally:
+            conn.close()
+
+    # --- Agregações (lidas do rollup monthly_totals; devolvem apenas resultados pequenos) ---
+
+    def get_summary(self, filters=None, target_currency=None):
+        """Devolve um dicionário com count, total, currency_count e currency (se houver uma só moeda).
+
+        Com `target_currency`, o total é convertido para essa moeda (ver convert_amounts) e
+        currency passa a ser a moeda de destino, com converted=True.
+        """
+        return dict(self._cached("summary", filters, self._query_summary, target_currency))
+
+    def _query_summary(self, filters, target_currency):
+        where, params = self._build_where(filters)
+        query = ("SELECT COALESCE(SUM(count), 0), COALESCE(SUM(total_cents), 0), COUNT(DISTINCT currency), MIN(currency) FROM monthly_totals" + where)
+        with self._reading() as conn:
+            count, total_cents, currency_count, currency = conn.execute(query, params).fetchone()
+        summary = {"count": count, "total": total_cents / MINOR_UNITS, "currency_count": currency_count,
+                   "currency": currency if currency_count == 1 else None, "converted": False}
+        if target_currency and count:
+            converted = self.convert_amounts(self._query_grouped(filters, ()), target_currency)
+            summary.update(total=float(converted['amount'].sum()), currency=target_currency, converted=True)
+        return summary
+
+    def _query_grouped(self, filters, columns):
+        """Totais por (year, month, currency) mais as colunas extra indicadas, base das conversões de moeda."""
+        where, params = self._build_where(filters)
+        group = ", ".join(("year", "month", "currency") + tuple(columns))
+        query = f"SELECT {group}, SUM(total_cents) / {MINOR_UNITS}.0 AS amount FROM monthly_totals{where} GROUP BY {group}"
+        return self._read_frame(query, params)
+
+    def get_category_totals(self, filters=None, target_currency=None):
+        """Total por categoria: DataFrame com colunas category e amount (convertido, se `target_currency`)."""
+        return self._cached("categories", filters, self._query_category_totals, target_currency)
+
+    def _query_category_totals(self, filters, target_currency):
+        if target_currency:
+            converted = self.convert_amounts(self._query_grouped(filters, ("category",)), target_currency)
+            return converted.groupby('category', as_index=False)['amount'].sum()
+        where, params = self._build_where(filters)
+        query = f"SELECT category, SUM(total_cents) / {MINOR_UNITS}.0 AS amount FROM monthly_totals" + where + " GROUP BY category ORDER BY category"
+        return self._read_frame(query, params)
+
+    def get_monthly_totals(self, filters=None, target_currency=None):
+        """Total por mês: DataFrame com colunas period ('AAAA-MM') e amount, incluindo meses sem despesas."""
+        return self._cached("monthly", filters, self._query_monthly_totals, target_currency)
+
+    def _query_monthly_totals(self, filters, target_currency):
+        if target_currency:
+            return monthly_series(self.convert_amounts(self._query_grouped(filters, ()), target_currency))
+        where, params = self._build_where(filters)
+        query = f"SELECT year, month, SUM(total_cents) / {MINOR_UNITS}.0 AS amount FROM monthly_totals" + where + " GROUP BY year, month ORDER BY year, month"
+        return monthly_series(self._read_frame(query, params))
+
+    def get_report_aggregates(self, filters=None):
+        """Totais e contagens por (currency, year, month, category), lidos diretamente do rollup monthly_totals.
+
+        Base dos relatórios em lote: cada relatório é depois obtido filtrando este resultado em memória.
+        """
+        where, params = self._build_where(filters)
+        query = (f"SELECT currency, year, month, category, total_cents / {MINOR_UNITS}.0 AS amount, count FROM monthly_totals" + where)
+        return self._read_frame(query, params)
+
+    # --- Manutenção do rollup ---
+
+    def rebuild_rollup(self):
+        """Recalcula monthly_totals a partir de expenses; devolve o número de linhas do rollup."""
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM monthly_totals")
+            conn.execute("INSERT INTO monthly_totals (year, month, category, currency, total_cents, count) "
+                         + self.ROLLUP_SOURCE_QUERY)
+            return conn.execute("SELECT COUNT(*) FROM monthly_totals").fetchone()[0]
+
+    def verify_rollup(self):
+        """Compara monthly_totals com expenses; devolve as linhas divergentes (vazio se estiver correto).
+
+        Cada linha é (origem, year, month, category, currency, total_cents, count), em que origem indica
+        se o valor é o esperado ('expenses') ou o guardado ('monthly_totals').
+        """
+        stored = "SELECT year, month, category, currency, total_cents, count FROM monthly_totals"
+        with self._lock:
+            conn = self._get_connection()
+            expected_only = conn.execute(f"{self.ROLLUP_SOURCE_QUERY} EXCEPT {stored}").fetchall()
+            stored_only = conn.execute(f"{stored} EXCEPT {self.ROLLUP_SOURCE_QUERY}").fetchall()
+        return [("expenses",) + row for row in expected_only] + [("monthly_totals",) + row for row in stored_only]
+
+    # --- Câmbio ---
+
+    def load_fx_rates(self, path):
+        """Carrega taxas de um CSV (date, currency, rate = valor de 1 unidade em EUR); devolve o nº de taxas gravadas.
+
+        Aceita ';' ou ',' como separador; taxas já existentes para a mesma data e moeda são substituídas.
+        """
+        import pandas as pd
+        with open(path, encoding="utf-8-sig") as fh:
+            header = fh.readline()
+        sep = ";" if header.count(";") > header.count(",") else ","
+        df = pd.read_csv(path, sep=sep, dtype=str, encoding="utf-8-sig", keep_default_na=False)
+        df.columns = [c.strip().lower() for c in df.columns]
+        dates = pd.to_datetime(df["date"].str.strip(), errors="coerce")
+        currency = df["currency"].str.strip().str.upper()
+        rate = pd.to_numeric(df["rate"].str.strip().str.replace(",", ".", regex=False), errors="coerce")
+        valid = dates.notna() & currency.isin(list(CURRENCY_MAP)) & (rate > 0)
+        rows = zip(dates[valid].dt.strftime("%Y-%m-%d").tolist(), currency[valid].tolist(), rate[valid].tolist())
+        written = 0
+        with self._transaction() as conn:
+            for chunk in _chunked(rows, self.BATCH_SIZE):
+                conn.executemany("INSERT OR REPLACE INTO fx_rates (rate_date, currency, rate) VALUES (?, ?, ?)", chunk)
+                written += len(chunk)
+        return written
+
+    def get_fx_rates(self):
+        """Tabela de taxas (rate_date como datetime, currency, rate), memorizada até à próxima escrita."""
+        return self._cached("fx_rates", None, self._query_fx_rates)
+
+    def _query_fx_rates(self, filters):
+        import pandas as pd
+        df = self._read_frame("SELECT rate_date, currency, rate FROM fx_rates ORDER BY rate_date", [])
+        df['rate_date'] = pd.to_datetime(df['rate_date'])
         return df
 
+    def convert_amounts(self, df, target_currency):
+        """Converte `df` (year, month, currency, amount) para `target_currency` numa única operação vetorizada.
+
+        Para cada mês usa a última taxa publicada até ao fim desse mês (ou, se não houver, a primeira
+        posterior). Lança FxRateMissing se alguma moeda não tiver taxas.
+        """
+        import pandas as pd
+        if df.empty:
+            return df.assign(currency=target_currency)
+        rates = self.get_fx_rates()
+        currencies = set(df['currency']) | {target_currency}
+        missing = sorted(currencies - set(rates['currency']) - {FX_BASE_CURRENCY})
+        if missing:
+            raise FxRateMissing(f"Sem taxas de câmbio para: {', '.join(missing)}")
+
+        periods = df[['year', 'month']].drop_duplicates()
+        grid = periods.merge(pd.DataFrame({'currency': sorted(currencies)}), how='cross')
+        grid['period_end'] = pd.to_datetime(dict(year=grid['year'], month=grid['month'], day=1)) + pd.offsets.MonthEnd(0)
+        grid = grid.sort_values('period_end', ignore_index=True)
+        asof = dict(left_on='period_end', right_on='rate_date', by='currency')
+        rate = pd.merge_asof(grid, rates, direction='backward', **asof)['rate']
+        rate = rate.fillna(pd.merge_asof(grid, rates, direction='forward', **asof)['rate'])
+        grid['rate'] = rate.where(grid['currency'] != FX_BASE_CURRENCY, 1.0)
+
+        to_base = df.merge(grid[['year', 'month', 'currency', 'rate']], on=['year', 'month', 'currency'], how='left')['rate'].to_numpy()
+        target_rates = grid[grid['currency'] == target_currency][['year', 'month', 'rate']]
+        from_base = df[['year', 'month']].merge(target_rates, on=['year', 'month'], how='left')['rate'].to_numpy()
+        return df.assign(amount=(df['amount'].to_numpy() * to_base / from_base).round(2), currency=target_currency)
+
+    def explain_query_plan(self, filters=None):
+        """Devolve as linhas de EXPLAIN QUERY PLAN da consulta de get_data_as_dataframe."""
+        query, params = self._select_query(filters)
+        with self._lock:
+            rows = self._get_connection().execute("EXPLAIN QUERY PLAN " + query, params).fetchall()
+        return [row[-1] for row in rows]
+
+    def check_query_plans(self):
+        """Verifica que todas as combinações de filtros usam um índice e dispensam a ordenação completa.
+
+        Filtrar por mês sem ano só admite uma ordenação parcial (por ano) dentro do índice
+        ("TEMP B-TREE FOR RIGHT PART OF ORDER BY"), o que é aceite. Devolve uma lista de
+        (filtros, plano) com as combinações que falharam.
+        """
+        sample = {"year": 2024, "month": 1, "category": CATEGORIES[0], "currency": "EUR"}
+        failures = []
+        for size in range(len(sample) + 1):
+            for columns in itertools.combinations(sample, size):
+                filters = {column: sample[column] for column in columns}
+                plan = self.explain_query_plan(filters)
+                uses_index = any("USING INDEX" in step or "USING COVERING INDEX" in step for step in plan)
+                if not uses_index or any(step.startswith("USE TEMP B-TREE FOR ORDER BY") for step in plan):
+                    failures.append((filters, plan))
+        return failures
+
+# --- IMPORTAÇÃO DE EXTRATOS BANCÁRIOS ---
+
+class StatementImporter:
+    """Importa extratos bancários (CSV ou OFX) em blocos de tamanho fixo.
+
+    Cada bloco é validado e normalizado de forma vetorizada e gravado numa
+    transação própria, pelo que o consumo de memória não depende do tamanho do ficheiro.
+
+    Regra do sinal (igual para CSV e OFX): num extrato com sinal (OFX, ou um CSV com algum
+    valor negativo) só os débitos (valores negativos) são despesas; os créditos são ignorados
+    e contados como rejeitados. Num CSV sem valores negativos, como o exportado pela
+    aplicação, todos os valores são despesas. Num CSV, o sinal e o separador decimal são
+    decididos numa primeira passagem pela coluna de valores (scan_layout), pelo que o
+    resultado não depende do tamanho dos blocos.
+    """
+    CHUNK_SIZE = 10000
+    COLUMNS = ["year", "month", "category", "amount", "currency"]
+    COLUMN_ALIASES = {
+        "ano": "year", "mes": "month", "mês": "month", "categoria": "category",
+        "valor": "amount", "moeda": "currency", "data": "date",
+    }
+    OFX_TAG = re.compile(r"<(/?\w+)>([^<\r\n]*)")
+    # Formatos de valor aceites. "1.234" e "1,234" são ambíguos (milhares ou decimais) e só são
+    # aceites quando o resto do ficheiro mostra qual é o separador decimal.
+    AMOUNT_COMMA_DECIMAL = r"[+-]?(?:\d{1,3}(?:\.\d{3})+|\d+),\d+"
+    AMOUNT_DOT_DECIMAL = r"[+-]?(?:\d{1,3}(?:,\d{3})+|\d+)\.\d+"
+    AMOUNT_AMBIGUOUS = r"[+-]?\d{1,3}[.,]\d{3}"
+    AMOUNT_INTEGER = r"[+-]?\d+"
+
+    def __init__(self, db, chunksize=CHUNK_SIZE, default_currency="EUR", default_category="Outros"):
+        if default_currency not in CURRENCY_MAP:
+            raise ValueError(f"Moeda desconhecida: {default_currency}")
+        if default_category not in CATEGORIES:
+            raise ValueError(f"Categoria desconhecida: {default_category}")
+        self.db = db
+        self.chunksize = chunksize
+        self.default_currency = default_currency
+        self.default_category = default_category
+        self._categories = {c.casefold(): c for c in CATEGORIES}
+
+    def import_file(self, path, progress=None):
+        """Importa um ficheiro e devolve (linhas importadas, linhas rejeitadas).
+
+        `progress`, se indicado, é chamado após cada bloco com (importadas, rejeitadas, fração lida).
+        Linhas de CSV com um número de campos errado contam como rejeitadas; um ficheiro que não
+        pode ser lido (vazio, aspas por fechar, codificação) lança StatementError com o caminho,
+        mantendo os blocos já gravados.
+        """
+        imported = rejected = 0
+        total_bytes = os.path.getsize(path) or 1
+        is_ofx = path.lower().endswith(".ofx")
+        bad_lines = [0]
+        try:
+            layout = {"decimal": ".", "signed": True} if is_ofx else self.scan_layout(path)
+            with open(path, "rb") as fh:
+                chunks = self._read_ofx(fh) if is_ofx else self._read_csv(fh, bad_lines=bad_lines)
+                for chunk in chunks:
+                    valid, n_rejected = self.normalize(chunk, layout)
+                    imported += self.db.add_expenses(zip(*(valid[col].tolist() for col in self.COLUMNS)))
+                    rejected += n_rejected + bad_lines[0]
+                    bad_lines[0] = 0
+                    if progress:
+                        progress(imported, rejected, min(fh.tell() / total_bytes, 1.0))
+        except (StatementError, UnicodeDecodeError) as e:
+            raise StatementError(f"{path}: {_first_line(e)}") from None
+        return imported, rejected + bad_lines[0]
+
+    def scan_layout(self, path):
+        """Percorre só a coluna de valores de um CSV e devolve o formato do ficheiro inteiro.
+
+        {"decimal": "," / "." / None (não revelado ou misto), "signed": há algum valor negativo}.
+        """
+        comma_seen = dot_seen = signed = False
+        with open(path, "rb") as fh:
+            for chunk in self._read_csv(fh, columns=("amount",)):
+                if "amount" not in chunk:
+                    break
+                raw = chunk["amount"].astype(str).str.strip()
+                ambiguous, comma, dot = self._amount_styles(raw)
+                comma_seen = comma_seen or bool(comma.any())
+                dot_seen = dot_seen or bool(dot.any())
+                signed = signed or bool((raw.str.startswith("-") & (ambiguous | comma | dot | raw.str.fullmatch(self.AMOUNT_INTEGER))).any())
+        decimal = ("," if comma_seen else ".") if comma_seen != dot_seen else None
+        return {"decimal": decimal, "signed": signed}
+
+    def _read_csv(self, fh, columns=None, bad_lines=None):
+        """Lê um CSV (separador ',' ou ';') em blocos de texto; os valores são interpretados em normalize.
+
+        Com `columns`, lê apenas essas colunas (nomes normalizados, p. ex. ("amount",)). As linhas
+        com um número de campos diferente do cabeçalho são saltadas e contadas em bad_lines[0]. As
+        linhas são separadas pelo módulo csv e não pelo pd.read_csv: lido em blocos, o pandas trata
+        estas linhas conforme a posição no bloco (salta-as, corta-as ou faz dos primeiros campos o
+        índice) e, quando as deixa contar, engole em silêncio uma aspa por fechar e o resto do ficheiro.
+        """
+        import pandas as pd
+        header = fh.readline().decode("utf-8-sig", errors="replace")
+        if not header.strip():
+            raise StatementError("ficheiro vazio")
+        fh.seek(0)
+        sep = ";" if header.count(";") > header.count(",") else ","
+        bad_lines = [0] if bad_lines is None else bad_lines
+        text = TextIOWrapper(fh, encoding="utf-8-sig", newline="")
+        try:
+            reader = csv.reader(text, delimiter=sep, skipinitialspace=True, strict=True)
+            names = [self.COLUMN_ALIASES.get(name.strip().lower(), name.strip().lower()) for name in next(reader)]
+            keep = [i for i, name in enumerate(names) if not columns or name in columns]
+            pick = (lambda fields: fields) if len(keep) == len(names) else (lambda fields: [fields[i] for i in keep])
+            rows = []
+            try:
+                for fields in reader:
+                    if len(fields) != len(names):
+                        bad_lines[0] += bool(fields)  # as linhas em branco não contam
+                        continue
+                    rows.append(pick(fields))
+                    if len(rows) >= self.chunksize:
+                        yield pd.DataFrame(rows, columns=[names[i] for i in keep]); rows = []
+            except csv.Error as e:
+                raise StatementError(f"formato inválido na linha {reader.line_num} ({e})") from None
+            if rows:
+                yield pd.DataFrame(rows, columns=[names[i] for i in keep])
+        finally:
+            text.detach()  # o ficheiro é de quem o abriu
+
+    def _read_ofx(self, fh):
+        """Percorre um OFX linha a linha e gera blocos com as transações (os créditos são descartados em normalize)."""
+        currency, rows, current = self.default_currency, [], None
+        for raw_line in fh:
+            for tag, value in self.OFX_TAG.findall(raw_line.decode("utf-8", errors="replace")):
+                tag, value = tag.upper(), value.strip()
+                if tag == "CURDEF":
+                    currency = value
+                elif tag == "STMTTRN":
+                    current = {}
+                elif tag == "/STMTTRN" and current is not None:
+                    rows.append((current.get("DTPOSTED", ""), current.get("TRNAMT", ""), currency))
+                    current = None
+                elif current is not None and tag in ("DTPOSTED", "TRNAMT"):
+                    current[tag] = value
+            if len(rows) >= self.chunksize:
+                yield self._ofx_frame(rows)
+                rows = []
+        if rows:
+            yield self._ofx_frame(rows)
+
+    @staticmethod
+    def _ofx_frame(rows):
+        import pandas as pd
+        frame = pd.DataFrame(rows, columns=["date", "amount", "currency"])
+        frame["year"] = frame["date"].str.slice(0, 4)
+        frame["month"] = frame["date"].str.slice(4, 6)
+        return frame.drop(columns="date")
+
+    def _amount_styles(self, raw):
+        """Máscaras (ambíguo, vírgula decimal, ponto decimal) dos valores em texto."""
+        ambiguous = raw.str.fullmatch(self.AMOUNT_AMBIGUOUS)
+        comma = raw.str.fullmatch(self.AMOUNT_COMMA_DECIMAL) & ~ambiguous
+        dot = raw.str.fullmatch(self.AMOUNT_DOT_DECIMAL) & ~ambiguous
+        return ambiguous, comma, dot
+
+    def parse_amounts(self, raw, layout):
+        """Converte valores em texto para números, com vírgula ou ponto decimal.
+
+        O separador decimal é o de layout["decimal"] (ver scan_layout) ou, se ainda não tiver sido
+        decidido, o revelado pelos valores inequívocos deste bloco ("12,50", "1.234,56", "12.50").
+        Valores ambíguos ("1.234") seguem esse separador; se não for conhecido (ou o ficheiro
+        misturar os dois), ficam NaN e a linha é rejeitada.
+        """
+        import pandas as pd
+        ambiguous, comma, dot = self._amount_styles(raw)
+        if "decimal" not in layout and comma.any() != dot.any():
+            layout["decimal"] = "," if comma.any() else "."
+        if layout.get("decimal") == ",":
+            comma |= ambiguous
+        elif layout.get("decimal") == ".":
+            dot |= ambiguous
+        dot |= raw.str.fullmatch(self.AMOUNT_INTEGER)
+        # Texto normalizado para ponto decimal; os valores que não são de nenhum formato ficam None (NaN).
+        text = pd.Series(None, index=raw.index, dtype=object)
+        text = text.mask(dot, raw.str.replace(",", "", regex=False))
+        text = text.mask(comma, raw.str.replace(".", "", regex=False).str.replace(",", ".", regex=False))
+        return pd.to_numeric(text, errors="coerce")
+
+    def normalize(self, chunk, layout=None):
+        """Valida e normaliza um bloco; devolve (DataFrame válido, número de linhas rejeitadas).
+
+        `layout` é o formato dos valores do ficheiro (scan_layout). Sem ele, o separador decimal e
+        o sinal são decididos pelo primeiro bloco que os revele e mantidos nos blocos seguintes.
+        """
+        import pandas as pd
+        layout = {} if layout is None else layout
+        n = len(chunk)
+        empty = pd.Series([""] * n, index=chunk.index, dtype=object)
+
+        if "date" in chunk and ("year" not in chunk or "month" not in chunk):
+            dates = pd.to_datetime(chunk["date"], dayfirst=True, errors="coerce")
+            chunk = chunk.assign(year=dates.dt.year, month=dates.dt.month)
+
+        year = pd.to_numeric(chunk.get("year", empty), errors="coerce")
+        month_raw = chunk.get("month", empty).astype(str).str.strip()
+        month = pd.to_numeric(month_raw, errors="coerce").fillna(month_raw.str.capitalize().map(MONTH_MAP))
+        amount = self.parse_amounts(chunk.get("amount", empty).astype(str).str.strip(), layout)
+        if "signed" not in layout and amount.notna().any():
+            layout["signed"] = bool((amount < 0).any())
+        if layout.get("signed"):
+            amount = -amount.where(amount < 0)
+        amount = amount.round(2)
+        currency = chunk.get("currency", empty).astype(str).str.strip().str.upper().replace("", self.default_currency)
+        category = (chunk.get("category", empty).astype(str).str.strip().str.casefold()
+                    .map(self._categories).fillna(self.default_category))
+
+        valid = (year.between(1900, 2100) & month.between(1, 12) & (amount > 0)
+                 & currency.isin(list(CURRENCY_MAP)))
+        result = pd.DataFrame({
+            "year": year[valid].astype(int),
+            "month": month[valid].astype(int),
+            "category": category[valid],
+            "amount": amount[valid].astype(float),
+            "currency": currency[valid],
+        })
+        return result, n - int(valid.sum())
+
+# --- EXPORTAÇÃO COLUNAR E SNAPSHOTS ---
+# pyarrow é opcional: só é necessário para exportar Parquet/Arrow e abrir snapshots.
+
+COLUMNAR_FORMATS = {".parquet": "parquet", ".arrow": "arrow", ".feather": "arrow", ".ipc": "arrow"}
+
+
+def _require_pyarrow():
+    try:
+        import pyarrow
+    except ImportError:
+        raise RuntimeError("A exportação Parquet/Arrow requer o pacote opcional pyarrow (pip install pyarrow).") from None
+    return pyarrow
+
+
+def columnar_schema():
+    """Esquema Arrow das despesas; os valores ficam em cêntimos inteiros, como na base de dados."""
+    pa = _require_pyarrow()
+    return pa.schema([("id", pa.int64()), ("year", pa.int16()), ("month", pa.int8()), ("category", pa.string()),
+                      ("amount_cents", pa.int64()), ("currency", pa.string())])
+
+
+def export_columnar(db, path, filters=None, fmt=None, batch_size=65536, progress=None):
+    """Exporta as despesas filtradas para Parquet (zstd) ou Arrow IPC, bloco a bloco, e devolve o nº de linhas.
+
+    O formato é deduzido da extensão se `fmt` não for indicado. A memória usada depende apenas
+    de `batch_size`; `progress`, se indicado, é chamado após cada bloco com o total já escrito.
+    Se a exportação for interrompida, o ficheiro parcial é apagado.
+    """
+    pa = _require_pyarrow()
+    fmt = fmt or COLUMNAR_FORMATS.get(os.path.splitext(path)[1].lower())
+    if fmt not in ("parquet", "arrow"):
+        raise ValueError(f"Formato colunar desconhecido para {path} (use .parquet ou .arrow)")
+    schema = columnar_schema()
+    if fmt == "parquet":
+        import pyarrow.parquet as pq
+        writer = pq.ParquetWriter(path, schema, compression="zstd")
+    else:
+        writer = pa.ipc.new_file(path, schema)
+    written = 0
+    with stats.span(f"export.{fmt}"):
+        try:
+            try:
+                for rows in db.iter_row_batches(filters, batch_size):
+                    columns = [pa.array(values, type=field.type) for values, field in zip(zip(*rows), schema)]
+                    writer.write_batch(pa.record_batch(columns, schema=schema))
+                    written += len(rows)
+                    if progress:
+                        progress(written)
+            finally:
+                writer.close()
+        except BaseException:
+            # Exportação cancelada (o `progress` pode lançar TaskCancelled) ou falhada: não deixar um ficheiro truncado.
+            if os.path.exists(path):
+                os.remove(path)
+            raise
+    stats.incr("export.rows", written)
+    return written
+
+
+class ArrowSnapshot:
+    """Cópia só de leitura das despesas num ficheiro Arrow IPC, mapeada em memória.
+
+    Oferece as mesmas agregações que DatabaseManager (get_summary, get_category_totals,
+    get_monthly_totals), calculadas com pyarrow.compute sobre as colunas do ficheiro, sem
+    copiar os dados nem abrir a base de dados. Não inclui taxas de câmbio: pedir uma moeda
+    de destino lança FxRateMissing.
+    """
+
+    def __init__(self, path):
+        pa = _require_pyarrow()
+        self.path = path
+        self._source = pa.memory_map(path, "r")
+        self.table = pa.ipc.open_file(self._source).read_all()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def close(self):
+        self.table = None
+        self._source.close()
+
+    def _filtered(self, filters):
+        import pyarrow.compute as pc
+        table = self.table
+        if table is None:
+            raise ValueError(f"O snapshot {self.path} já foi fechado.")
+        mask = None
+        for column, value in normalize_filters(filters):
+            condition = pc.equal(table[column], value)
+            mask = condition if mask is None else pc.and_(mask, condition)
+        return table if mask is None else table.filter(mask)
+
+    @staticmethod
+    def _require_native(target_currency):
+        if target_currency:
+            raise FxRateMissing("O snapshot não inclui taxas de câmbio; abra a base de dados para converter valores.")
+
+    def get_summary(self, filters=None, target_currency=None):
+        import pyarrow.compute as pc
+        self._require_native(target_currency)
+        table = self._filtered(filters)
+        currencies = pc.unique(table['currency']).to_pylist()
+        total_cents = pc.sum(table['amount_cents']).as_py() or 0
+        return {"count": table.num_rows, "total": total_cents / MINOR_UNITS, "currency_count": len(currencies),
+                "currency": currencies[0] if len(currencies) == 1 else None, "converted": False}
+
+    def _grouped(self, filters, keys):
+        grouped = self._filtered(filters).group_by(keys).aggregate([("amount_cents", "sum")]).to_pandas()
+        return grouped.assign(amount=grouped.pop('amount_cents_sum') / MINOR_UNITS)
+
+    def get_category_totals(self, filters=None, target_currency=None):
+        self._require_native(target_currency)
+        return self._grouped(filters, ["category"]).sort_values('category', ignore_index=True)
+
+    def get_monthly_totals(self, filters=None, target_currency=None):
+        self._require_native(target_currency)
+        return monthly_series(self._grouped(filters, ["year", "month"]))
+
+# --- TAREFAS EM SEGUNDO PLANO ---
+
+class TaskCancelled(Exception):
+    """Lançada dentro de uma tarefa quando esta foi cancelada."""
+
+
+class TaskContext:
+    """Passado a cada tarefa: permite reportar progresso e verificar cancelamento."""
+
+    def __init__(self, runner, channel, generation, on_success=None, on_error=None, on_progress=None):
+        self.runner = runner
+        self.channel = channel
+        self.generation = generation
+        self.on_success = on_success
+        self.on_error = on_error
+        self.on_progress = on_progress
+        self._cancel_event = threading.Event()
+
+    @property
+    def cancelled(self):
+        return self._cancel_event.is_set()
+
+    def cancel(self):
+        self._cancel_event.set()
+
+    def check(self):
+        """Interrompe a tarefa (TaskCancelled) se tiver sido cancelada."""
+        if self._cancel_event.is_set():
+            raise TaskCancelled()
+
+    def progress(self, fraction, text=""):
+        """Reporta progresso (0..1); é entregue na thread da interface."""
+        self.check()
+        self.runner._results.put((self, "progress", (fraction, text)))
+
+
+class TaskRunner:
+    """Executa tarefas num pool de threads e entrega os resultados na thread do Tk via after().
+
+    Cada tarefa pertence a um canal ("table", "pdf", ...). Submeter ou cancelar num canal
+    invalida a tarefa anterior desse canal: os seus resultados, se chegarem, são descartados.
+    As tarefas longas (long=True: importações, exportações, PDF, pré-carregamento) correm num
+    pool próprio, para nunca ocuparem as threads que atualizam a tabela e o resumo.
+    """
+    POLL_MS = 50
+
+    def __init__(self, widget, max_workers=2, long_workers=2):
+        self._widget = widget
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="gestor-despesas")
+        self._long_executor = ThreadPoolExecutor(max_workers=long_workers, thread_name_prefix="gestor-despesas-long")
+        self._results = queue.Queue()
+        self._generations = {}
+        self._active = {}
+        self._polling = False
+
+    def submit(self, channel, fn, *args, on_success=None, on_error=None, on_progress=None, long=False):
+        """Executa `fn(*args, task)` em segundo plano e devolve o TaskContext criado."""
+        self.cancel(channel)
+        task = TaskContext(self, channel, self._generations[channel], on_success, on_error, on_progress)
+        executor = self._long_executor if long else self._executor
+        self._active[channel] = (executor.submit(self._run, task, fn, args), task)
+        if not self._polling:
+            self._polling = True
+            self._widget.after(self.POLL_MS, self._poll)
+        return task
+
+    def _run(self, task, fn, args):
+        try:
+            self._results.put((task, "success", fn(*args, task)))
+        except TaskCancelled:
+            self._results.put((task, "cancelled", None))
+        except Exception as e:
+            self._results.put((task, "error", e))
+
+    def cancel(self, channel):
+        """Cancela a tarefa do canal (se existir) e descarta qualquer resultado pendente dela."""
+        self._generations[channel] = self._generations.get(channel, 0) + 1
+        future, task = self._active.pop(channel, (None, None))
+        if task is not None:
+            task.cancel()
+            future.cancel()
+
+    def _poll(self):
+        while True:
+            try:
+                task, kind, value = self._results.get_nowait()
+            except queue.Empty:
+                break
+            if task.generation != self._generations.get(task.channel):
+                continue  # resultado obsoleto (filtros mudaram ou tarefa cancelada)
+            if kind == "progress":
+                if task.on_progress: task.on_progress(*value)
+                continue
+            self._active.pop(task.channel, None)
+            if kind == "success" and task.on_success:
+                task.on_success(value)
+            elif kind == "error":
+                if task.on_error: task.on_error(value)
+                else: logger.error("Erro na tarefa '%s'", task.channel, exc_info=value)
+        if self._active or not self._results.empty():
+            self._widget.after(self.POLL_MS, self._poll)
+        else:
+            self._polling = False
+
+    def shutdown(self):
+        """Cancela todas as tarefas e espera pelas que já estão a correr (param no próximo task.check())."""
+        for channel in list(self._active):
+            self.cancel(channel)
+        self._executor.shutdown(wait=True, cancel_futures=True)
+        self._long_executor.shutdown(wait=True, cancel_futures=True)
+
+# --- RELATÓRIOS PDF ---
+
+def _first_line(error):
+    """Primeira linha não vazia da mensagem de uma exceção (as do Kaleido ocupam vários parágrafos)."""
+    return next((line.strip() for line in str(error).splitlines() if line.strip()), type(error).__name__)
+
+
+class _KaleidoServer:
+    """Instância Kaleido (Chrome headless) mantida aberta num event loop próprio.
+
+    O plotly arranca um browser novo em cada to_image(); aqui o browser e os seus
+    separadores são reutilizados entre gráficos e entre relatórios.
+    """
+
+    def __init__(self, tabs=3, timeout=90):
+        import kaleido
+        self._loop = asyncio.new_event_loop()
+        threading.Thread(target=self._loop.run_forever, name="kaleido", daemon=True).start()
+        try:
+            self._kaleido = self._call(self._open(kaleido, tabs, timeout))
+        except BaseException:
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            raise
+
+    @staticmethod
+    async def _open(kaleido, tabs, timeout):
+        return await kaleido.Kaleido(n=tabs, timeout=timeout)
+
+    def _call(self, coroutine):
+        return asyncio.run_coroutine_threadsafe(coroutine, self._loop).result()
+
+    def to_png(self, fig, width, height):
+        return self._call(self._kaleido.calc_fig(fig.to_dict(), opts={"format": "png", "width": width, "height": height, "scale": 1}))
+
+    def close(self):
+        try:
+            self._call(self._kaleido.close())
+        finally:
+            self._loop.call_soon_threadsafe(self._loop.stop)
+
+
+class ChartRenderer:
+    """Desenha os gráficos dos relatórios PDF em memória, sem ficheiros temporários.
+
+    backend "plotly": PNG gerado pelo Kaleido, reutilizando o mesmo Chrome headless;
+    backend "reportlab": gráficos vetoriais nativos (reportlab.graphics), sem browser;
+    backend "auto": usa o plotly e recorre ao reportlab enquanto o Kaleido não arrancar (nova
+    tentativa a cada SERVER_RETRY_SECONDS) e nos gráficos em que a conversão para PNG falhar.
+    Os gráficos de um relatório são gerados em paralelo.
+    """
+    BACKENDS = ("auto", "plotly", "reportlab")
+    SERVER_RETRY_SECONDS = 300
+    SERIES_COLOR = "#636EFA"  # cor padrão do plotly, para os dois backends terem o mesmo aspeto
+    PIE_COLORS = ["#636EFA", "#EF553B", "#00CC96", "#AB63FA", "#FFA15A", "#19D3F3", "#FF6692", "#B6E880"]
+
+    def __init__(self, backend="auto", max_workers=3):
+        if backend not in self.BACKENDS:
+            raise ValueError(f"Backend de gráficos desconhecido: {backend}")
+        self.backend = backend
+        self._max_workers = max_workers
+        self._server = None
+        self._server_retry_at = 0.0
+        self._server_lock = threading.Lock()
+
+    def warm_up(self):
+        """Arranca o Kaleido antecipadamente (só relevante para os backends plotly/auto)."""
+        if self.backend != "reportlab":
+            self._get_server()
+
+    def _get_server(self):
+        with self._server_lock:
+            if self._server is None and time.monotonic() >= self._server_retry_at:
+                try:
+                    self._server = _KaleidoServer(tabs=self._max_workers)
+                except Exception as e:
+                    self._server_retry_at = time.monotonic() + self.SERVER_RETRY_SECONDS
+                    logger.warning("Kaleido partilhado indisponível (nova tentativa daqui a %d s): %s",
+                                   self.SERVER_RETRY_SECONDS, _first_line(e))
+            return self._server
+
+    def close(self):
+        with self._server_lock:
+            if self._server is not None:
+                self._server.close()
+                self._server = None
+
+    def render_all(self, charts):
+        """Gera vários gráficos em paralelo. `charts` mapeia nome -> (tipo, DataFrame, símbolo da moeda)."""
+        with ThreadPoolExecutor(max_workers=self._max_workers, thread_name_prefix="chart") as executor:
+            futures = {name: executor.submit(self.render, *spec) for name, spec in charts.items()}
+            return {name: future.result() for name, future in futures.items()}
+
+    def render(self, kind, data, symbol):
+        """Devolve um ImageReader (plotly) ou um Drawing (reportlab) pronto a desenhar com draw()."""
+        with stats.span(f"chart.{kind}"):
+            return self._render(kind, data, symbol)
+
+    def _render(self, kind, data, symbol):
+        from reportlab.lib.utils import ImageReader
+        if self.backend == "reportlab":
+            return getattr(self, f"_reportlab_{kind}")(data, symbol)
+        server = self._get_server()
+        if server is None and self.backend == "auto":
+            # Kaleido não arrancou (o aviso e a próxima tentativa ficam a cargo de _get_server).
+            stats.incr("chart.fallback_reportlab")
+            return getattr(self, f"_reportlab_{kind}")(data, symbol)
+        # Erros nos dados ou na construção da figura são erros do programa: propagam-se.
+        fig, width, height = getattr(self, f"_plotly_{kind}")(data, symbol)
+        try:
+            png = server.to_png(fig, width, height) if server else fig.to_image(format="png", width=width, height=height)
+        except Exception as e:
+            if self.backend != "auto":
+                raise
+            # Falha pontual (p. ex. timeout do Chrome): só este gráfico passa para o ReportLab.
+            logger.warning("Kaleido falhou no gráfico %s; a usar o ReportLab: %s", kind, _first_line(e))
+            stats.incr("chart.fallback_reportlab")
+            return getattr(self, f"_reportlab_{kind}")(data, symbol)
+        return ImageReader(BytesIO(png))
+
+    @staticmethod
+    def draw(c, chart, x, y, width, height, anchor='c'):
+        """Desenha o gráfico na caixa indicada, preservando a proporção (como drawImage)."""
+        from reportlab.graphics import renderPDF
+        from reportlab.graphics.shapes import Drawing
+        if isinstance(chart, Drawing):
+            scale = min(width / chart.width, height / chart.height)
+            drawn_width, drawn_height = chart.width * scale, chart.height * scale
+            dx = x + (width - drawn_width) / 2
+            dy = y + (height - drawn_height if anchor == 'n' else (height - drawn_height) / 2)
+            c.saveState()
+            c.translate(dx, dy); c.scale(scale, scale)
+            renderPDF.draw(chart, c, 0, 0)
+            c.restoreState()
+        else:
+            c.drawImage(chart, x, y, width=width, height=height, preserveAspectRatio=True, anchor=anchor)
+
+    # --- Plotly ---
+
+    @staticmethod
+    def _plotly_bar(data, symbol):
+        import plotly.express as px
+        fig = px.bar(data, x='category', y='amount', text_auto='.2f')
+        fig.update_layout(title_text='', yaxis_title=f"Valor ({symbol})", xaxis_title="")
+        return fig, 700, 400
+
+    @staticmethod
+    def _plotly_pie(data, symbol):
+        import plotly.express as px
+        fig = px.pie(data, names='category', values='amount')
+        fig.update_layout(title_text='')
+        return fig, 600, 450
+
+    @staticmethod
+    def _plotly_line(data, symbol):
+        import plotly.express as px
+        fig = px.line(data, x='period', y='amount', title="", markers=True, text=data['amount'].round(2))
+        fig.update_traces(textposition="top center")
+        fig.update_layout(yaxis_title=f'Total Gasto ({symbol})', xaxis_title='Mês')
+        return fig, 700, 400
+
+    # --- ReportLab (vetorial) ---
+
+    def _reportlab_bar(self, data, symbol):
+        from reportlab.lib import colors
+        from reportlab.graphics.shapes import Drawing, String
+        from reportlab.graphics.charts.barcharts import VerticalBarChart
+        drawing = Drawing(700, 400)
+        chart = VerticalBarChart()
+        chart.x, chart.y, chart.width, chart.height = 70, 50, 610, 320
+        chart.data = [data['amount'].tolist()]
+        chart.categoryAxis.categoryNames = data['category'].tolist()
+        chart.valueAxis.valueMin = 0
+        chart.bars[0].fillColor = colors.HexColor(self.SERIES_COLOR)
+        chart.barLabelFormat = '%.2f'
+        chart.barLabels.nudge = 8
+        chart.categoryAxis.labels.fontName = chart.valueAxis.labels.fontName = chart.barLabels.fontName = "Helvetica"
+        drawing.add(chart)
+        drawing.add(String(10, 385, f"Valor ({symbol})", fontName="Helvetica", fontSize=10))
+        return drawing
+
+    def _reportlab_pie(self, data, symbol):
+        from reportlab.lib import colors
+        from reportlab.graphics.shapes import Drawing
+        from reportlab.graphics.charts.piecharts import Pie
+        drawing = Drawing(600, 450)
+        chart = Pie()
+        chart.x, chart.y, chart.width, chart.height = 150, 75, 300, 300
+        chart.data = data['amount'].tolist()
+        total = sum(chart.data) or 1
+        chart.labels = [f"{category} ({amount / total:.1%})" for category, amount in zip(data['category'], chart.data)]
+        chart.sideLabels = True
+        chart.slices.fontName = "Helvetica"
+        for i in range(len(chart.data)):
+            chart.slices[i].fillColor = colors.HexColor(self.PIE_COLORS[i % len(self.PIE_COLORS)])
+            chart.slices[i].strokeColor = colors.white
+        drawing.add(chart)
+        return drawing
+
+    def _reportlab_line(self, data, symbol):
+        from reportlab.lib import colors
+        from reportlab.graphics.shapes import Drawing, String
+        from reportlab.graphics.charts.linecharts import HorizontalLineChart
+        from reportlab.graphics.widgets.markers import makeMarker
+        drawing = Drawing(700, 400)
+        chart = HorizontalLineChart()
+        chart.x, chart.y, chart.width, chart.height = 70, 60, 610, 300
+        chart.data = [data['amount'].round(2).tolist()]
+        chart.categoryAxis.categoryNames = data['period'].tolist()
+        if len(data) > 12:
+            chart.categoryAxis.labels.angle = 45
+            chart.categoryAxis.labels.boxAnchor = 'ne'
+        chart.valueAxis.valueMin = 0
+        chart.lines[0].strokeColor = colors.HexColor(self.SERIES_COLOR)
+        chart.lines[0].symbol = makeMarker('FilledCircle')
+        chart.lineLabelFormat = '%.2f'
+        chart.categoryAxis.labels.fontName = chart.valueAxis.labels.fontName = chart.lineLabels.fontName = "Helvetica"
+        drawing.add(chart)
+        drawing.add(String(10, 385, f"Total Gasto ({symbol})", fontName="Helvetica", fontSize=10))
+        return drawing
+
+
+def build_pdf_report(filepath, summary, category_spending, monthly_totals, task=None, renderer=None):
+    """Gera o relatório PDF a partir dos agregados da vista (resumo, totais por categoria e por mês)."""
+    from reportlab.pdfgen import canvas
+    from reportlab.lib.pagesizes import letter
+    from reportlab.lib.units import inch
+    renderer = renderer or ChartRenderer()
+    currency_code = summary["currency"]
+    symbol = CURRENCY_MAP.get(currency_code, "")
+    total_view = summary["total"]
+
+    # Os três gráficos são gerados em paralelo, em memória, antes de montar as páginas.
+    charts = {"bar": ("bar", category_spending, symbol)}
+    if total_view > 0:
+        charts["pie"] = ("pie", category_spending, symbol)
+    # Só cria o gráfico de linha se houver mais de 1 mês com dados
+    if len(monthly_totals) > 1:
+        charts["line"] = ("line", monthly_totals, symbol)
+    if task: task.progress(0.1, "A desenhar gráficos...")
+    rendered = renderer.render_all(charts)
+    if task: task.progress(0.8, "A montar PDF...")
+
+    c = canvas.Canvas(filepath, pagesize=letter)
+    width, height = letter
+
+    # --- Primeira Página: Resumo e Gráfico de Barras ---
+    c.setFont("Helvetica-Bold", 18)
+    c.drawCentredString(width / 2.0, height - inch, "Relatório de Despesas")
+
+    c.setFont("Helvetica-Oblique", 10)
+    filter_text = f"Relatório para a moeda: {currency_code} ({symbol})"
+    if summary.get("converted"):
+        filter_text += " - valores convertidos com as taxas de câmbio locais"
+    c.drawCentredString(width / 2.0, height - 1.25 * inch, filter_text)
+
+    c.setFont("Helvetica-Bold", 12)
+    c.drawString(inch, height - 2.0 * inch, "Resumo")
+    c.setFont("Helvetica", 11)
+    c.drawString(inch, height - 2.25 * inch, f"Total Gasto: {symbol} {total_view:.2f}")
+    c.drawString(inch, height - 2.50 * inch, f"Número de Transações: {summary['count']}")
+
+    c.setFont("Helvetica-Bold", 12)
+    c.drawString(inch, height - 3.25 * inch, "Gastos por Categoria")
+    renderer.draw(c, rendered["bar"], inch, height - 7.0 * inch, 6.5*inch, 3.5*inch, anchor='n')
+
+    # --- Segunda Página: Gráfico Circular ---
+    if "pie" in rendered:
+        c.showPage()
+        c.setFont("Helvetica-Bold", 18)
+        c.drawCentredString(width / 2.0, height - inch, "Distribuição de Despesas")
+        renderer.draw(c, rendered["pie"], width/2 - (5*inch)/2, height - 6.5*inch, 5*inch, 4.5*inch)
+
+    # --- Terceira Página: Gráfico de Linha (Evolução Mensal) ---
+    if "line" in rendered:
+        c.showPage()
+        c.setFont("Helvetica-Bold", 18)
+        c.drawCentredString(width / 2.0, height - inch, "Evolução Mensal das Despesas")
+        renderer.draw(c, rendered["line"], inch, height - 6.0 * inch, 6.5*inch, 3.5*inch, anchor='n')
+
+    if task: task.check()
+    c.save()
+    return filepath
+
 # --- CLASSE PRINCIPAL DA APLICAÇÃO ---
 
 class ExpenseTrackerApp(ctk.CTk):
-    def __init__(self):
+    # A tabela é carregada por páginas à medida que o utilizador desliza.
+    PAGE_SIZE = 200
+    PREFETCH_FRACTION = 0.2  # carrega a página seguinte quando falta menos de 20% da parte carregada
+    PREWARM_DELAY_MS = 500
+
+    def __init__(self, db_name="expenses.db"):
         super().__init__()
         
-        self.db = DatabaseManager()
+        self.db = DatabaseManager(db_name)
+        self.tasks = TaskRunner(self)
+        self.chart_renderer = ChartRenderer()
 
         self.title("Gestor de Despesas Pessoal v3.0 - Multimoeda")
         self.geometry("1300x700")
 
-        self.currency_map = {"BRL": "R$", "USD": "$", "EUR": "€"}
-        self.month_map = {"Janeiro": 1, "Fevereiro": 2, "Março": 3, "Abril": 4, "Maio": 5, "Junho": 6, "Julho": 7, "Agosto": 8, "Setembro": 9, "Outubro": 10, "Novembro": 11, "Dezembro": 12}
-        self.month_map_inv = {v: k for k, v in self.month_map.items()}
-        self.categories = ["Alimentação", "Moradia", "Transporte", "Serviços", "Lazer", "Outros"]
+        self.currency_map = CURRENCY_MAP
+        self.month_map = MONTH_MAP
+        self.month_map_inv = MONTH_MAP_INV
+        self.categories = CATEGORIES
         self.years = [str(i) for i in range(datetime.now().year + 1, 2020, -1)]
         self.current_filters = {}
+        self._table_cursor = None
+        self._table_exhausted = True
+        self._page_pending = False
+        self._busy = {}  # canal -> [fração, texto] das tarefas longas em curso, pela ordem de início
+        self.snapshot = None
 
         self.setup_ui()
+        self.protocol("WM_DELETE_WINDOW", self.on_close)
         self.populate_table()
+        self.after(self.PREWARM_DELAY_MS, self.prewarm_modules)
+
+    def prewarm_modules(self):
+        """Carrega plotly/reportlab e arranca o Kaleido em segundo plano depois de a janela aparecer."""
+        self.tasks.submit("prewarm", self._prewarm, long=True)
+
+    def _prewarm(self, task):
+        _import_modules(HEAVY_MODULES, task)
+        task.check()
+        self.chart_renderer.warm_up()
+
+    def on_close(self):
+        """Cancela as tarefas em curso, espera que terminem e só então fecha a base de dados e destrói a janela."""
+        self.tasks.shutdown()
+        self.chart_renderer.close()
+        if self.snapshot: self.snapshot.close()
+        self.db.close()
+        self.destroy()
+
+    @property
+    def analytics(self):
+        """Fonte dos totais, gráficos e PDF: o snapshot Arrow aberto ou, por omissão, a base de dados."""
+        return self.snapshot or self.db
 
     def setup_ui(self):
         self.grid_columnconfigure(1, weight=1); self.grid_rowconfigure(0, weight=1)
@@ -138,6 +1568,9 @@ class ExpenseTrackerApp(ctk.CTk):
         ctk.CTkLabel(left_frame, text="Ações", font=ctk.CTkFont(size=16, weight="bold")).grid(row=8, column=0, columnspan=2, padx=20, pady=10)
         self.delete_button = ctk.CTkButton(left_frame, text="Apagar Despesa Selecionada", command=self.delete_expense, fg_color="#D32F2F", hover_color="#B71C1C"); self.delete_button.grid(row=9, column=0, columnspan=2, padx=20, pady=10, sticky="ew")
         self.export_csv_button = ctk.CTkButton(left_frame, text="Exportar Tudo para CSV", command=self.export_to_csv); self.export_csv_button.grid(row=10, column=0, columnspan=2, padx=20, pady=10, sticky="ew")
+        self.import_button = ctk.CTkButton(left_frame, text="Importar Extrato (CSV/OFX)", command=self.import_statement); self.import_button.grid(row=11, column=0, columnspan=2, padx=20, pady=10, sticky="ew")
+        self.export_columnar_button = ctk.CTkButton(left_frame, text="Exportar Parquet/Arrow", command=self.export_to_columnar); self.export_columnar_button.grid(row=12, column=0, columnspan=2, padx=20, pady=5, sticky="ew")
+        self.snapshot_button = ctk.CTkButton(left_frame, text="Abrir Snapshot Arrow", command=self.toggle_snapshot); self.snapshot_button.grid(row=13, column=0, columnspan=2, padx=20, pady=5, sticky="ew")
 
     def setup_right_panel(self):
         right_frame = ctk.CTkFrame(self, corner_radius=10); right_frame.grid(row=0, column=1, padx=(0, 10), pady=10, sticky="nsew"); right_frame.grid_columnconfigure(0, weight=1); right_frame.grid_rowconfigure(2, weight=1)
@@ -164,6 +1597,11 @@ class ExpenseTrackerApp(ctk.CTk):
         
         summary_frame = ctk.CTkFrame(right_frame, fg_color="transparent"); summary_frame.grid(row=1, column=0, padx=10, pady=5, sticky="ew")
         self.total_label = ctk.CTkLabel(summary_frame, text="Total na Vista: ", font=ctk.CTkFont(size=14, weight="bold")); self.total_label.pack(side="left", padx=10)
+        ctk.CTkLabel(summary_frame, text="Converter para:").pack(side="left", padx=(20, 5))
+        self.report_currency_optionmenu = ctk.CTkOptionMenu(summary_frame, values=["Sem conversão"] + list(self.currency_map.keys()), width=130, command=lambda _: self.update_summary()); self.report_currency_optionmenu.pack(side="left", padx=5)
+        self.cancel_button = ctk.CTkButton(summary_frame, text="Cancelar", width=80, command=self.cancel_background_task, fg_color="gray", state="disabled"); self.cancel_button.pack(side="right", padx=5)
+        self.progress_bar = ctk.CTkProgressBar(summary_frame, width=160); self.progress_bar.set(0); self.progress_bar.pack(side="right", padx=5)
+        self.status_label = ctk.CTkLabel(summary_frame, text=""); self.status_label.pack(side="right", padx=5)
         
         charts_frame = ctk.CTkFrame(right_frame); charts_frame.grid(row=3, column=0, padx=10, pady=10, sticky="ew")
         ctk.CTkLabel(charts_frame, text="Visualizações:", font=ctk.CTkFont(size=12, weight="bold")).pack(side="left", padx=10)
@@ -179,17 +1617,96 @@ class ExpenseTrackerApp(ctk.CTk):
         self.tree.heading("ID", text="ID"); self.tree.heading("Ano", text="Ano"); self.tree.heading("Mês", text="Mês"); self.tree.heading("Categoria", text="Categoria"); self.tree.heading("Valor", text="Valor")
         self.tree.column("ID", width=40, anchor="center"); self.tree.column("Ano", width=60, anchor="center"); self.tree.column("Mês", width=100, anchor="center"); self.tree.column("Categoria", width=150, anchor="center"); self.tree.column("Valor", width=100, anchor="e")
         self.tree.grid(row=0, column=0, sticky="nsew")
-        scrollbar = ctk.CTkScrollbar(table_frame, command=self.tree.yview); scrollbar.grid(row=0, column=1, sticky="ns"); self.tree.configure(yscrollcommand=scrollbar.set)
+        self.table_scrollbar = ctk.CTkScrollbar(table_frame, command=self.tree.yview); self.table_scrollbar.grid(row=0, column=1, sticky="ns"); self.tree.configure(yscrollcommand=self.on_tree_scroll)
+
+    # --- Tarefas longas: barra de progresso e cancelamento ---
+
+    def run_background_task(self, channel, text, fn, *args, on_success=None):
+        """Executa uma tarefa longa com barra de progresso, estado e botão Cancelar.
+
+        Várias tarefas longas podem correr ao mesmo tempo: a barra mostra a mais recente e
+        Cancelar interrompe essa, passando a mostrar a anterior ainda em curso.
+        """
+        self._busy.pop(channel, None)
+        self._busy[channel] = [0, text]
+        self._show_busy()
+
+        def finish():
+            self._busy.pop(channel, None)
+            self._show_busy()
+
+        def success(result):
+            finish()
+            if on_success: on_success(result)
+
+        def error(e):
+            finish()
+            logger.error("Erro na tarefa '%s'", channel, exc_info=e)
+            messagebox.showerror("Erro", f"Ocorreu um erro: {e}")
+
+        def progress(fraction, status):
+            if channel in self._busy:
+                self._busy[channel] = [fraction, status or self._busy[channel][1]]
+                self._show_busy()
+
+        self.tasks.submit(channel, fn, *args, on_success=success, on_error=error, on_progress=progress, long=True)
+
+    def _show_busy(self):
+        if not self._busy:
+            self.status_label.configure(text=""); self.progress_bar.set(0); self.cancel_button.configure(state="disabled")
+            return
+        fraction, text = self._busy[next(reversed(self._busy))]
+        others = f" (+{len(self._busy) - 1} em curso)" if len(self._busy) > 1 else ""
+        self.status_label.configure(text=text + others); self.progress_bar.set(fraction); self.cancel_button.configure(state="normal")
+
+    def cancel_background_task(self, channel=None):
+        """Cancela a tarefa longa indicada ou, por omissão, a mais recente."""
+        channel = channel or next(reversed(self._busy), None)
+        if channel not in self._busy: return
+        del self._busy[channel]
+        self.tasks.cancel(channel)
+        self._show_busy()
+        if not self._busy: self.status_label.configure(text="Cancelado.")
+        if channel == "import":
+            self.populate_table()  # os blocos já gravados continuam na base de dados
+
+    # --- Tabela ---
+
+    def on_tree_scroll(self, first, last):
+        """Atualiza a barra de deslocamento e pede a página seguinte quando o fim da parte carregada se aproxima."""
+        self.table_scrollbar.set(first, last)
+        if not self._table_exhausted and not self._page_pending and float(last) >= 1.0 - self.PREFETCH_FRACTION:
+            self.load_next_page()
+
+    def load_next_page(self):
+        """Pede em segundo plano a página seguinte da tabela; o resultado é descartado se os filtros mudarem."""
+        if self._table_exhausted: return
+        self._page_pending = True
+        self.tasks.submit("table", self._fetch_page, dict(self.current_filters), self._table_cursor,
+                          on_success=self._append_page, on_error=self._page_failed)
+
+    def _fetch_page(self, filters, cursor, task):
+        return fetch_table_page(self.db, filters, cursor, self.PAGE_SIZE)
+
+    def _append_page(self, result):
+        rows, self._table_cursor = result
+        for values in rows:
+            self.tree.insert("", "end", values=values)
+        self._table_exhausted = len(rows) < self.PAGE_SIZE
+        self._page_pending = False
+
+    def _page_failed(self, e):
+        self._page_pending = False
+        self._table_exhausted = True
+        messagebox.showerror("Erro", f"Não foi possível carregar a tabela: {e}")
 
     def populate_table(self):
-        for item in self.tree.get_children(): self.tree.delete(item)
-        df = self.db.get_data_as_dataframe(self.current_filters)
-        for _, row in df.iterrows():
-            month_name = self.month_map_inv.get(row['month'], "N/A")
-            currency_symbol = self.currency_map.get(row['currency'], "")
-            formatted_amount = f"{currency_symbol} {row['amount']:.2f}"
-            formatted_row = [row['id'], row['year'], month_name, row['category'], formatted_amount]
-            self.tree.insert("", "end", values=formatted_row)
+        self.tasks.cancel("table")
+        self.tree.delete(*self.tree.get_children())
+        self._table_cursor = None
+        self._table_exhausted = False
+        self._page_pending = False
+        self.load_next_page()
         self.update_summary()
 
     def add_expense(self):
@@ -211,8 +1728,7 @@ class ExpenseTrackerApp(ctk.CTk):
         selected_items = self.tree.selection()
         if not selected_items: messagebox.showinfo("Aviso", "Selecione uma despesa para apagar."); return
         if messagebox.askyesno("Confirmar", f"Apagar {len(selected_items)} despesa(s) selecionada(s)?"):
-            for item_id in selected_items:
-                self.db.delete_expense(self.tree.item(item_id)['values'][0])
+            self.db.delete_expenses(self.tree.item(item_id)['values'][0] for item_id in selected_items)
             self.populate_table()
             messagebox.showinfo("Sucesso", "Despesas apagadas.")
 
@@ -236,45 +1752,91 @@ class ExpenseTrackerApp(ctk.CTk):
         self.current_filters = {}
         self.populate_table()
 
+    def _report_currency(self):
+        """Moeda escolhida em 'Converter para', ou None."""
+        value = self.report_currency_optionmenu.get()
+        return value if value in self.currency_map else None
+
     def update_summary(self):
-        df = self.db.get_data_as_dataframe(self.current_filters)
-        if df.empty:
-            self.total_label.configure(text="Total na Vista: N/A")
+        self.tasks.submit("summary", self._fetch_summary, dict(self.current_filters), self._report_currency(),
+                          on_success=self._show_summary)
+
+    def _fetch_summary(self, filters, target_currency, task):
+        """Resumo da vista; com uma moeda de conversão escolhida e diferente da(s) da vista, converte o total."""
+        source = self.analytics
+        summary = source.get_summary(filters)
+        if target_currency and summary["count"] and summary["currency"] != target_currency:
+            try:
+                summary = source.get_summary(filters, target_currency=target_currency)
+            except FxRateMissing as e:
+                summary["fx_error"] = str(e)
+        return summary
+
+    def _show_summary(self, summary):
+        label = "Total no Snapshot" if self.snapshot else "Total na Vista"
+        if summary["count"] == 0:
+            self.total_label.configure(text=f"{label}: N/A")
             return
         
-        currencies_in_view = df['currency'].unique()
-        if len(currencies_in_view) == 1:
-            total = df['amount'].sum()
-            symbol = self.currency_map.get(currencies_in_view[0], "")
-            self.total_label.configure(text=f"Total na Vista: {symbol} {total:.2f}")
+        if summary["currency"]:
+            symbol = self.currency_map.get(summary["currency"], "")
+            suffix = " (convertido)" if summary["converted"] else " (sem taxas para converter)" if "fx_error" in summary else ""
+            self.total_label.configure(text=f"{label}: {symbol} {summary['total']:.2f}{suffix}")
+        elif "fx_error" in summary:
+            self.total_label.configure(text=f"{label}: Múltiplas Moedas (sem taxas de câmbio)")
         else:
-            self.total_label.configure(text="Total na Vista: Múltiplas Moedas")
+            self.total_label.configure(text=f"{label}: Múltiplas Moedas")
 
-    def _pre_export_check(self):
-        """Verifica se há dados e se a moeda é única antes de gerar gráficos/PDF."""
-        df = self.db.get_data_as_dataframe(self.current_filters)
-        if df.empty:
-            messagebox.showinfo("Sem Dados", "Não há dados na vista atual para gerar o relatório."); return None
+    def _pre_export_check(self, summary):
+        """Verifica se há dados e se a moeda é única (ou convertida) antes de gerar gráficos/PDF."""
+        if summary["count"] == 0:
+            messagebox.showinfo("Sem Dados", "Não há dados na vista atual para gerar o relatório."); return False
         
-        currencies = df['currency'].unique()
-        if len(currencies) > 1:
-            messagebox.showwarning("Múltiplas Moedas", "Gráficos e relatórios só podem ser gerados para uma única moeda de cada vez.\n\nPor favor, use o filtro 'Moeda' para selecionar apenas uma.")
-            return None
+        if summary["currency"] is None:
+            detail = f"\n\n{summary['fx_error']}" if "fx_error" in summary else ""
+            messagebox.showwarning("Múltiplas Moedas", "Gráficos e relatórios só podem ser gerados para uma única moeda de cada vez.\n\nPor favor, use o filtro 'Moeda' para selecionar apenas uma, ou escolha uma moeda em 'Converter para' (requer taxas de câmbio carregadas)." + detail)
+            return False
+
+        if "fx_error" in summary:
+            messagebox.showwarning("Sem Taxas de Câmbio", f"Não foi possível converter os valores para a moeda escolhida em 'Converter para'.\n\n{summary['fx_error']}\n\nCarregue as taxas de câmbio ou escolha 'Sem conversão'.")
+            return False
         
-        return df
+        return True
+
+    def _load_report_data(self, filters, target_currency, task):
+        """Lê (em segundo plano) os agregados necessários para gráficos e PDF."""
+        summary = self._fetch_summary(filters, target_currency, task)
+        task.check()
+        if summary["count"] == 0 or summary["currency"] is None:
+            return summary, None, None
+        target = summary["currency"] if summary["converted"] else None
+        source = self.analytics
+        return summary, source.get_category_totals(filters, target), source.get_monthly_totals(filters, target)
 
     def generate_graphs(self):
-        df = self._pre_export_check()
-        if df is None: return
-        
-        symbol = self.currency_map.get(df['currency'].iloc[0], '')
-        category_spending = df.groupby('category')['amount'].sum().reset_index()
+        self.run_background_task("charts", "A preparar gráficos...", self._build_category_chart, dict(self.current_filters),
+                                 self._report_currency(), on_success=self._show_chart)
+
+    def _build_category_chart(self, filters, target_currency, task):
+        import plotly.express as px
+        summary, category_spending, _ = self._load_report_data(filters, target_currency, task)
+        if category_spending is None:
+            return summary, None
+        symbol = self.currency_map.get(summary["currency"], '')
         fig = px.bar(category_spending, x='category', y='amount', title="Gastos por Categoria", labels={'amount': f'Valor ({symbol})', 'category': 'Categoria'})
+        return summary, fig
+
+    def _show_chart(self, result):
+        summary, fig = result
+        if not self._pre_export_check(summary): return
         fig.show()
 
     def export_to_pdf(self):
-        df = self._pre_export_check()
-        if df is None:
+        self.run_background_task("pdf", "A preparar relatório...", self._load_report_data, dict(self.current_filters),
+                                 self._report_currency(), on_success=self._ask_pdf_path)
+
+    def _ask_pdf_path(self, report_data):
+        if not self._pre_export_check(report_data[0]):
             return
 
         filepath = filedialog.asksaveasfilename(
@@ -284,98 +1846,299 @@ class ExpenseTrackerApp(ctk.CTk):
         if not filepath:
             return
 
-        try:
-            currency_code = df['currency'].iloc[0]
-            symbol = self.currency_map.get(currency_code, "")
-
-            c = canvas.Canvas(filepath, pagesize=letter)
-            width, height = letter
-
-            # --- Primeira Página: Resumo e Gráfico de Barras ---
-            c.setFont("Helvetica-Bold", 18)
-            c.drawCentredString(width / 2.0, height - inch, "Relatório de Despesas")
-
-            c.setFont("Helvetica-Oblique", 10)
-            filter_text = f"Relatório para a moeda: {currency_code} ({symbol})"
-            c.drawCentredString(width / 2.0, height - 1.25 * inch, filter_text)
-
-            total_view = df['amount'].sum()
-            c.setFont("Helvetica-Bold", 12)
-            c.drawString(inch, height - 2.0 * inch, "Resumo")
-            c.setFont("Helvetica", 11)
-            c.drawString(inch, height - 2.25 * inch, f"Total Gasto: {symbol} {total_view:.2f}")
-            c.drawString(inch, height - 2.50 * inch, f"Número de Transações: {len(df)}")
-
-            c.setFont("Helvetica-Bold", 12)
-            c.drawString(inch, height - 3.25 * inch, "Gastos por Categoria")
-            
-            category_spending = df.groupby('category')['amount'].sum().reset_index()
-            fig_bar = px.bar(category_spending, x='category', y='amount', text_auto='.2f')
-            fig_bar.update_layout(title_text='', yaxis_title=f"Valor ({symbol})", xaxis_title="")
-            
-            bar_chart_path = "temp_bar_chart.png"
-            fig_bar.write_image(bar_chart_path, width=700, height=400)
-            
-            c.drawImage(bar_chart_path, inch, height - 7.0 * inch, width=6.5*inch, height=3.5*inch, preserveAspectRatio=True, anchor='n')
-            
-            os.remove(bar_chart_path)
-
-            # --- Segunda Página: Gráfico Circular ---
-            if not df.empty and df['amount'].sum() > 0:
-                c.showPage()
-                c.setFont("Helvetica-Bold", 18)
-                c.drawCentredString(width / 2.0, height - inch, "Distribuição de Despesas")
-
-                fig_pie = px.pie(df, names='category', values='amount')
-                fig_pie.update_layout(title_text='')
-
-                pie_chart_path = "temp_pie_chart.png"
-                fig_pie.write_image(pie_chart_path, width=600, height=450)
-
-                c.drawImage(pie_chart_path, width/2 - (5*inch)/2, height - 6.5*inch, width=5*inch, height=4.5*inch, preserveAspectRatio=True)
-
-                os.remove(pie_chart_path)
-
-            # --- Terceira Página: Gráfico de Linha (Evolução Mensal) ---
-            df_line = df.copy()
-            df_line['period'] = pd.to_datetime(df_line['year'].astype(str) + '-' + df_line['month'].astype(str), format='%Y-%m')
-            monthly_totals = df_line.groupby(pd.Grouper(key='period', freq='M'))['amount'].sum().reset_index()
-            monthly_totals['period'] = monthly_totals['period'].dt.strftime('%Y-%m') # Formata para o gráfico
-
-            # Só cria o gráfico de linha se houver mais de 1 mês com dados
-            if len(monthly_totals) > 1:
-                c.showPage()
-                c.setFont("Helvetica-Bold", 18)
-                c.drawCentredString(width / 2.0, height - inch, "Evolução Mensal das Despesas")
-
-                fig_line = px.line(monthly_totals, x='period', y='amount', title="", markers=True, text=monthly_totals['amount'].round(2))
-                fig_line.update_traces(textposition="top center")
-                fig_line.update_layout(yaxis_title=f'Total Gasto ({symbol})', xaxis_title='Mês')
-
-                line_chart_path = "temp_line_chart.png"
-                fig_line.write_image(line_chart_path, width=700, height=400)
-
-                c.drawImage(line_chart_path, inch, height - 6.0 * inch, width=6.5*inch, height=3.5*inch, preserveAspectRatio=True, anchor='n')
-
-                os.remove(line_chart_path)
-
-            c.save()
-            messagebox.showinfo("Sucesso", f"PDF exportado com sucesso para {filepath}")
+        self.run_background_task("pdf", "A gerar PDF...", self._build_pdf, filepath, report_data,
+                                 on_success=lambda path: messagebox.showinfo("Sucesso", f"PDF exportado com sucesso para {path}"))
 
-        except Exception as e:
-            messagebox.showerror("Erro ao Gerar PDF", f"Ocorreu um erro: {e}")
-            print(f"DEBUG: Erro na geração do PDF: {e}")
+    def _build_pdf(self, filepath, report_data, task):
+        with stats.span("pdf.export"):
+            return build_pdf_report(filepath, *report_data, task=task, renderer=self.chart_renderer)
+
+    def import_statement(self):
+        filepaths = filedialog.askopenfilenames(filetypes=[("Extratos", "*.csv *.ofx"), ("CSV files", "*.csv"), ("OFX files", "*.ofx"), ("All files", "*.*")])
+        if not filepaths: return
+        importer = StatementImporter(self.db, default_currency=self.currency_optionmenu.get())
+        self.run_background_task("import", "A importar...", self._import_files, importer, filepaths,
+                                 on_success=self._import_finished)
+
+    @staticmethod
+    def _import_files(importer, filepaths, task):
+        imported = rejected = 0
+        failures = []
+        for index, filepath in enumerate(filepaths):
+            def report(done, skipped, fraction):
+                task.progress((index + fraction) / len(filepaths), f"A importar... {imported + done} linhas")
+            try:
+                done, skipped = importer.import_file(filepath, progress=report)
+            except StatementError as e:
+                failures.append(str(e)); continue
+            imported += done; rejected += skipped
+        return imported, rejected, failures
+
+    def _import_finished(self, result):
+        imported, rejected, failures = result
+        self.populate_table()
+        message = f"{imported} despesa(s) importada(s), {rejected} linha(s) rejeitada(s)."
+        if failures:
+            messagebox.showwarning("Importação Incompleta", message + "\n\nFicheiros não importados:\n" + "\n".join(failures))
+        else:
+            messagebox.showinfo("Importação Concluída", message)
 
     def export_to_csv(self):
-        df = self.db.get_data_as_dataframe()
+        self.run_background_task("csv", "A preparar exportação...", lambda task: self.db.get_data_as_dataframe(), on_success=self._ask_csv_path)
+
+    def _ask_csv_path(self, df):
         if df.empty: messagebox.showinfo("Sem Dados", "Não há nada para exportar."); return
         filepath = filedialog.asksaveasfilename(defaultextension=".csv", filetypes=[("CSV files", "*.csv")])
         if filepath:
-            df['month'] = df['month'].map(self.month_map_inv)
-            df.to_csv(filepath, index=False, decimal=',', sep=';')
-            messagebox.showinfo("Sucesso", f"Todos os dados foram exportados para {filepath}")
+            self.run_background_task("csv", "A exportar CSV...", self._write_csv, df, filepath,
+                                     on_success=lambda path: messagebox.showinfo("Sucesso", f"Todos os dados foram exportados para {path}"))
+
+    def _write_csv(self, df, filepath, task):
+        return write_csv_export(df, filepath)
+
+    def export_to_columnar(self):
+        filepath = filedialog.asksaveasfilename(defaultextension=".parquet", filetypes=[("Parquet", "*.parquet"), ("Arrow IPC", "*.arrow")])
+        if filepath:
+            self.run_background_task("columnar", "A exportar...", self._write_columnar, dict(self.current_filters), filepath,
+                                     on_success=lambda count: messagebox.showinfo("Sucesso", f"{count} despesa(s) exportada(s) para {filepath}"))
+
+    def _write_columnar(self, filters, filepath, task):
+        total = self.db.get_summary(filters)["count"] or 1
+        def report(written):
+            task.check()
+            task.progress(written / total, f"A exportar... {written} linhas")
+        return export_columnar(self.db, filepath, filters, progress=report)
+
+    def toggle_snapshot(self):
+        """Abre um snapshot Arrow como fonte dos totais e relatórios, ou fecha o que estiver aberto."""
+        if self.snapshot:
+            # As tarefas que ainda leem o snapshot são canceladas antes de o fechar (os seus resultados são descartados).
+            for channel in ("charts", "pdf"): self.cancel_background_task(channel)
+            self.tasks.cancel("summary")
+            self.snapshot.close(); self.snapshot = None
+            self.snapshot_button.configure(text="Abrir Snapshot Arrow")
+        else:
+            filepath = filedialog.askopenfilename(filetypes=[("Arrow IPC", "*.arrow *.feather *.ipc"), ("All files", "*.*")])
+            if not filepath: return
+            try:
+                self.snapshot = ArrowSnapshot(filepath)
+            except Exception as e:
+                messagebox.showerror("Erro", f"Não foi possível abrir o snapshot: {e}"); return
+            self.snapshot_button.configure(text="Fechar Snapshot")
+        self.update_summary()
+
+
+# --- RELATÓRIOS EM LOTE ---
+
+REPORT_DIMENSIONS = ("currency", "year", "month")
+
+# Estado de cada processo do pool de relatórios (criado por _init_report_worker).
+_report_worker = {}
+
+
+def _init_report_worker(db_name, chart_backend):
+    _report_worker["db"] = DatabaseManager(db_name, cache_size=0)
+    _report_worker["renderer"] = ChartRenderer(chart_backend, max_workers=1)
+    # Fecha o Chrome do Kaleido e a base de dados quando o processo sai. Os processos criados por
+    # fork terminam com os._exit e não correm o atexit; os finalizadores do multiprocessing correm
+    # em ambos os casos (o renderer primeiro: prioridade maior).
+    Finalize(None, _report_worker["renderer"].close, exitpriority=20)
+    Finalize(None, _report_worker["db"].close, exitpriority=10)
+
+
+def _run_report_job(job):
+    """Gera o PDF e/ou o CSV de um relatório; devolve a entrada do manifesto com os tempos."""
+    entry = {"name": job["name"], "filters": job["filters"], "rows": job["summary"]["count"],
+             "total": round(job["summary"]["total"], 2)}
+    try:
+        if job.get("pdf"):
+            started = time.perf_counter()
+            build_pdf_report(job["pdf"], job["summary"], job["category_totals"], job["monthly_totals"],
+                             renderer=_report_worker["renderer"])
+            entry["pdf"], entry["pdf_seconds"] = job["pdf"], round(time.perf_counter() - started, 4)
+        if job.get("csv"):
+            started = time.perf_counter()
+            write_csv_export(_report_worker["db"].get_data_as_dataframe(job["filters"]), job["csv"])
+            entry["csv"], entry["csv_seconds"] = job["csv"], round(time.perf_counter() - started, 4)
+    except Exception as e:
+        entry["error"] = f"{type(e).__name__}: {e}"
+    return entry
+
+
+def plan_report_jobs(aggregates, by, out_dir, formats, base_filters=None):
+    """Divide o resultado de get_report_aggregates em trabalhos, um por combinação de `by` com dados."""
+    jobs = []
+    for key, group in aggregates.groupby(list(by), sort=True):
+        key = key if isinstance(key, tuple) else (key,)
+        filters = dict(base_filters or {})
+        filters.update({dim: (value if dim == "currency" else int(value)) for dim, value in zip(by, key)})
+        name = "despesas_" + "_".join(f"{int(value):02d}" if dim == "month" else str(value) for dim, value in zip(by, key))
+        summary = {"count": int(group['count'].sum()), "total": float(group['amount'].sum()),
+                   "currency_count": 1, "currency": filters["currency"]}
+        jobs.append({
+            "name": name,
+            "filters": filters,
+            "summary": summary,
+            "category_totals": group.groupby('category', as_index=False)['amount'].sum(),
+            "monthly_totals": monthly_series(group),
+            "pdf": os.path.join(out_dir, name + ".pdf") if "pdf" in formats else None,
+            "csv": os.path.join(out_dir, name + ".csv") if "csv" in formats else None,
+        })
+    return jobs
+
+
+def generate_batch_reports(db, out_dir, by=REPORT_DIMENSIONS, filters=None, formats=("pdf",), workers=None,
+                           chart_backend="reportlab", progress=None):
+    """Gera relatórios por moeda/ano/mês num pool de processos e escreve manifest.json em `out_dir`.
+
+    A moeda entra sempre na divisão, tal como na interface só há relatórios de uma moeda.
+    """
+    by = ["currency"] + [dim for dim in REPORT_DIMENSIONS[1:] if dim in by]
+    os.makedirs(out_dir, exist_ok=True)
+    started = time.perf_counter()
+    aggregates = db.get_report_aggregates(filters)
+    aggregation_seconds = time.perf_counter() - started
+    jobs = plan_report_jobs(aggregates, by, out_dir, formats, base_filters=normalize_filters(filters))
+
+    entries = []
+    if jobs:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_report_worker,
+                                 initargs=(db.db_name, chart_backend)) as executor:
+            for entry in executor.map(_run_report_job, jobs):
+                entries.append(entry)
+                if progress: progress(len(entries), len(jobs), entry)
+
+    manifest = {
+        "generated_at": datetime.now().isoformat(timespec="seconds"),
+        "db": os.path.abspath(db.db_name),
+        "by": by,
+        "filters": dict(normalize_filters(filters)),
+        "formats": list(formats),
+        "chart_backend": chart_backend,
+        "aggregation_seconds": round(aggregation_seconds, 4),
+        "total_seconds": round(time.perf_counter() - started, 4),
+        "jobs": entries,
+    }
+    with open(os.path.join(out_dir, "manifest.json"), "w", encoding="utf-8") as fh:
+        json.dump(manifest, fh, ensure_ascii=False, indent=2)
+    return manifest
+
+# --- LINHA DE COMANDOS ---
+
+def _print_import_progress(imported, rejected, fraction):
+    print(f"\r  {fraction:6.1%}  {imported} importadas, {rejected} rejeitadas", end="", file=sys.stderr, flush=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Gestor de Despesas Pessoal. Sem comando, abre a interface gráfica.")
+    parser.add_argument("--db", default="expenses.db", help="Ficheiro da base de dados SQLite (padrão: expenses.db)")
+    parser.add_argument("--profile", action="store_true", help="Mede consultas, cache e gráficos e escreve os tempos no stderr ao sair")
+    subparsers = parser.add_subparsers(dest="command")
+
+    import_parser = subparsers.add_parser("import", help="Importa extratos bancários CSV/OFX")
+    import_parser.add_argument("files", nargs="+", help="Ficheiros .csv ou .ofx a importar")
+    import_parser.add_argument("--chunksize", type=int, default=StatementImporter.CHUNK_SIZE, help="Linhas por bloco/transação")
+    import_parser.add_argument("--currency", default="EUR", choices=list(CURRENCY_MAP), help="Moeda para linhas sem moeda")
+    import_parser.add_argument("--category", default="Outros", choices=CATEGORIES, help="Categoria para linhas sem categoria reconhecida")
+
+    subparsers.add_parser("check-indexes", help="Verifica com EXPLAIN QUERY PLAN que todos os filtros usam índices")
+
+    rollup_parser = subparsers.add_parser("rollup", help="Verifica ou reconstrói a tabela de totais mensais (monthly_totals)")
+    rollup_action = rollup_parser.add_mutually_exclusive_group(required=True)
+    rollup_action.add_argument("--verify", action="store_true", help="Compara o rollup com as despesas")
+    rollup_action.add_argument("--rebuild", action="store_true", help="Recalcula o rollup a partir das despesas")
+
+    fx_parser = subparsers.add_parser("fx-load", help="Carrega taxas de câmbio de um CSV (date;currency;rate, rate = valor de 1 unidade em EUR)")
+    fx_parser.add_argument("file", help="Ficheiro CSV com as taxas")
+
+    report_parser = subparsers.add_parser("report", help="Gera relatórios PDF/CSV em lote, por moeda, ano e mês")
+    report_parser.add_argument("--out", default="relatorios", help="Pasta de destino (padrão: relatorios)")
+    report_parser.add_argument("--by", default="currency,year,month", help="Divisão dos relatórios: combinação de currency, year, month (padrão: todas)")
+    report_parser.add_argument("--format", nargs="+", default=["pdf"], choices=["pdf", "csv"], dest="formats", help="Formatos a gerar")
+    report_parser.add_argument("--currency", choices=list(CURRENCY_MAP), help="Restringe a uma moeda")
+    report_parser.add_argument("--year", type=int, help="Restringe a um ano")
+    report_parser.add_argument("--month", type=int, choices=range(1, 13), metavar="1-12", help="Restringe a um mês")
+    report_parser.add_argument("--category", choices=CATEGORIES, help="Restringe a uma categoria")
+    report_parser.add_argument("--workers", type=int, default=None, help="Processos em paralelo (padrão: nº de CPUs)")
+    report_parser.add_argument("--charts", default="reportlab", choices=ChartRenderer.BACKENDS, help="Motor dos gráficos (padrão: reportlab, sem browser)")
+
+    export_parser = subparsers.add_parser("export", help="Exporta as despesas para Parquet ou Arrow IPC (requer pyarrow)")
+    export_parser.add_argument("out", help="Ficheiro de destino (.parquet, ou .arrow/.feather para snapshots mapeáveis em memória)")
+    export_parser.add_argument("--format", choices=["parquet", "arrow"], default=None, help="Formato (padrão: deduzido da extensão)")
+    export_parser.add_argument("--currency", choices=list(CURRENCY_MAP), help="Restringe a uma moeda")
+    export_parser.add_argument("--year", type=int, help="Restringe a um ano")
+    export_parser.add_argument("--month", type=int, choices=range(1, 13), metavar="1-12", help="Restringe a um mês")
+    export_parser.add_argument("--category", choices=CATEGORIES, help="Restringe a uma categoria")
+    export_parser.add_argument("--batch-size", type=int, default=65536, help="Linhas por bloco (padrão: 65536)")
+
+    args = parser.parse_args(argv)
+    if args.profile:
+        stats.enabled = True
+    if stats.enabled:
+        atexit.register(stats.dump)
+
+    if args.command is None:
+        app = ExpenseTrackerApp(db_name=args.db)
+        app.mainloop()
+        return 0
+
+    with DatabaseManager(args.db) as db:
+        if args.command == "import":
+            importer = StatementImporter(db, chunksize=args.chunksize, default_currency=args.currency, default_category=args.category)
+            failed = 0
+            for filepath in args.files:
+                print(f"A importar {filepath}", file=sys.stderr)
+                try:
+                    imported, rejected = importer.import_file(filepath, progress=_print_import_progress)
+                except (StatementError, OSError) as e:
+                    print(f"\nERRO: {e}", file=sys.stderr)
+                    failed += 1
+                    continue
+                print(f"\n{filepath}: {imported} importadas, {rejected} rejeitadas", file=sys.stderr)
+            return 1 if failed else 0
+        elif args.command == "check-indexes":
+            failures = db.check_query_plans()
+            for filters, plan in failures:
+                print(f"SEM ÍNDICE ADEQUADO: {filters or 'sem filtros'}\n  " + "\n  ".join(plan))
+            print(f"{len(failures)} combinação(ões) de filtros sem plano indexado.")
+            return 1 if failures else 0
+        elif args.command == "rollup":
+            if args.rebuild:
+                print(f"Rollup reconstruído: {db.rebuild_rollup()} linha(s).", file=sys.stderr)
+            else:
+                mismatches = db.verify_rollup()
+                for row in mismatches:
+                    print("DIVERGÊNCIA (%s): %s/%s %s %s total_cents=%s count=%s" % row)
+                print(f"{len(mismatches)} divergência(s) no rollup.")
+                return 1 if mismatches else 0
+        elif args.command == "fx-load":
+            print(f"{db.load_fx_rates(args.file)} taxa(s) de câmbio carregada(s).", file=sys.stderr)
+        elif args.command == "report":
+            by = [dim.strip() for dim in args.by.split(",") if dim.strip()]
+            unknown = set(by) - set(REPORT_DIMENSIONS)
+            if unknown:
+                parser.error(f"--by: dimensões desconhecidas: {', '.join(sorted(unknown))}")
+            filters = {"currency": args.currency, "year": args.year, "month": args.month, "category": args.category}
+
+            def report_progress(done, total, entry):
+                status = f"ERRO: {entry['error']}" if "error" in entry else "ok"
+                print(f"[{done}/{total}] {entry['name']}: {status}", file=sys.stderr)
+
+            manifest = generate_batch_reports(db, args.out, by=by, filters=filters, formats=args.formats, workers=args.workers,
+                                              chart_backend=args.charts, progress=report_progress)
+            failed = sum("error" in entry for entry in manifest["jobs"])
+            print(f"{len(manifest['jobs'])} relatório(s) em {manifest['total_seconds']:.1f}s; manifesto em {os.path.join(args.out, 'manifest.json')}", file=sys.stderr)
+            return 1 if failed else 0
+        elif args.command == "export":
+            filters = {"currency": args.currency, "year": args.year, "month": args.month, "category": args.category}
+            try:
+                count = export_columnar(db, args.out, filters, fmt=args.format, batch_size=args.batch_size)
+            except (RuntimeError, ValueError) as e:
+                print(e, file=sys.stderr)
+                return 1
+            print(f"{count} despesa(s) exportada(s) para {args.out}", file=sys.stderr)
+    return 0
 
 
 if __name__ == "__main__":
-    app = ExpenseTrackerApp()
-    app.mainloop()
\ No newline at end of file
+    sys.exit(main())
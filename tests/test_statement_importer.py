@@ -0,0 +1,46 @@
+import pytest
+
+from gestor_despesas import DatabaseManager, StatementError, StatementImporter
+
+# Extrato com sinal que começa com um crédito: o primeiro bloco (com chunksize=1) não tem negativos.
+SIGNED_STATEMENT = (
+    "date,amount,category\n"
+    "01/01/2024,2500.00,Outros\n"
+    "02/01/2024,-30.00,Lazer\n"
+    "03/01/2024,-1.234,Lazer\n"
+    "04/01/2024,1200.00,Outros\n"
+    "05/02/2024,-12.50,Alimentação\n"
+)
+
+
+@pytest.fixture
+def db(tmp_path):
+    with DatabaseManager(str(tmp_path / "test.db")) as db:
+        yield db
+
+
+@pytest.mark.parametrize("chunksize", [1, 2, 10000])
+def test_signed_csv_imports_only_debits_regardless_of_chunksize(db, tmp_path, chunksize):
+    path = tmp_path / "extrato.csv"
+    path.write_text(SIGNED_STATEMENT, encoding="utf-8")
+
+    imported, rejected = StatementImporter(db, chunksize=chunksize).import_file(str(path))
+
+    assert (imported, rejected) == (3, 2)
+    assert sorted(db.get_data_as_dataframe()["amount"]) == [1.23, 12.5, 30.0]
+
+
+def test_malformed_lines_are_rejected_not_fatal(db, tmp_path):
+    path = tmp_path / "extrato.csv"
+    path.write_text("date,amount,category\n01/01/2024,-10.00,Lazer\n02/01/2024,-5.00,Lazer,extra,campos\n"
+                    "03/01/2024,-7.50,Lazer\n", encoding="utf-8")
+
+    assert StatementImporter(db, chunksize=1).import_file(str(path)) == (2, 1)
+
+
+def test_empty_file_raises_statement_error_with_path(db, tmp_path):
+    path = tmp_path / "vazio.csv"
+    path.write_text("", encoding="utf-8")
+
+    with pytest.raises(StatementError, match="vazio.csv"):
+        StatementImporter(db).import_file(str(path))